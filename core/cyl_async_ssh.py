@@ -1,11 +1,25 @@
 import asyncio
+import contextlib
+import glob
 import json
 import os
-from typing import List
+import posixpath
+import shlex
+import tarfile
+import tempfile
+import time
+import uuid
+from typing import List, Optional
 
 import asyncssh
 
 from . import cyl_util, cyl_wrapper
+from .cyl_fleet import CYLFleetScheduler
+from .cyl_inventory import CYLInventory
+from .cyl_ssh_pool import CYLSSHPool
+
+## the errors which mean the connection itself is gone
+CONNECTION_ERRORS = (asyncssh.DisconnectError, ConnectionError)
 
 
 class CYLSCPConfig(object):
@@ -97,9 +111,15 @@ class CYLSCPConfig(object):
 
 class CYLAsyncSSH(object):
  
-    def __init__(self, logger=None):
+    def __init__(self, logger=None, pool: CYLSSHPool=None):
         self.conn = None
         self.logger = None
+        self.transfer_report = []
+        self.delta_report = {"skipped": [], "sent": [], "verified": []}
+        self.file_hashes = {}
+        ## borrow the connection from the pool instead of a handshake per use
+        self.pool = pool
+        self.broken = False
         pass
 
     async def connect(self, host, username, password, port: int=22, timeout: float=10):
@@ -119,7 +139,13 @@ class CYLAsyncSSH(object):
         self.logger.info(f"host ({self.host}) start to connect...")
         try:
             if self.conn:
-                self.conn.close()
+                await self.close()
+            if self.pool is not None:
+                self.conn = await self.pool.async_acquire(self.host, self.username, self.password,
+                                                          port=self.port, timeout=timeout)
+                self.logger.info(f"host ({self.host}) successfully connected.")
+                return
+
             self.conn = await asyncio.wait_for(asyncssh.connect(host=self.host, 
                                                                 port=self.port,
                                                                 username=self.username,
@@ -137,6 +163,20 @@ class CYLAsyncSSH(object):
     def is_connected(self):
         return self.conn != None
 
+    @contextlib.asynccontextmanager
+    async def _channel(self):
+        """Hold a channel slot of the pool while a channel is open, remember a broken connection."""
+        try:
+            if self.pool is not None:
+                async with self.pool.channel(self.conn):
+                    yield
+            else:
+                yield
+        except Exception as e:
+            if isinstance(e, CONNECTION_ERRORS) or self.conn.is_closed():
+                self.broken = True
+            raise
+
     @cyl_wrapper.handle_exception
     async def run_cmd(self, command, timeout: float=10, readuntil_expected: str=None, waiting_sec: float=0, **kwargs):
 
@@ -154,7 +194,7 @@ class CYLAsyncSSH(object):
             return True, out
 
         if readuntil_expected:
-            async with self.conn.create_process(command) as process:
+            async with self._channel(), self.conn.create_process(command) as process:
                 ret, out = await readuntil(process.stdout, readuntil_expected, timeout)
                 self.logger.info(f"waiting ({waiting_sec}) sec...")
                 await asyncio.sleep(waiting_sec)
@@ -162,7 +202,8 @@ class CYLAsyncSSH(object):
                 return ret, out
 
         ## 
-        res = await self.conn.run(command=command, timeout=timeout, **kwargs)
+        async with self._channel():
+            res = await self.conn.run(command=command, timeout=timeout, **kwargs)
         code = res.exit_status or res.returncode
 
         out = {}
@@ -177,20 +218,262 @@ class CYLAsyncSSH(object):
         await asyncio.sleep(waiting_sec)
         return code==0, out
 
+    @staticmethod
+    def make_session_script(cmd_list, token: str) -> str:
+        """Frame every command by the sentinel '<token>:<index>:' on stdout and stderr.
+
+        A command runs by eval in its own subshell with no stdin, like an
+        exec channel, so a cd, an exit or a syntax error stays inside it.
+        The stdout sentinel is followed by the exit status of the command.
+        """
+        script = ""
+        for i, cmd in enumerate(cmd_list):
+            quoted = cmd.replace("'", "'\\''")
+            script += f"( eval '{quoted}' ) </dev/null; echo \"{token}:{i}:$?\"; echo \"{token}:{i}:\" >&2\n"
+        return script + "exit\n"
+
+    async def run_session(self, cmd_list, timeout: float=10):
+        """Run the commands in one remote shell, return [{'cmd', 'exit_status', 'stdout', 'stderr'}].
+
+        All commands are written at once and the streams are split at the
+        sentinels. A command running over the timeout breaks the session,
+        it and the rest keep exit_status None.
+        """
+        cmd_list = list(cmd_list)
+        token = f"__CYL_{uuid.uuid4().hex}"
+        results = [{"cmd": cmd, "exit_status": None, "stdout": "", "stderr": ""} for cmd in cmd_list]
+        script = CYLAsyncSSH.make_session_script(cmd_list, token)
+        self.logger.debug(f"send session <SEND>\n{script}</SEND>")
+
+        i = 0
+        try:
+            async with self._channel(), self.conn.create_process() as process:
+                process.stdin.write(script)
+                process.stdin.write_eof()
+                for i, result in enumerate(results):
+                    marker = f"{token}:{i}:"
+                    ## both streams share the channel window, read them together
+                    out, err = await asyncio.wait_for(asyncio.gather(process.stdout.readuntil(marker),
+                                                                     process.stderr.readuntil(marker)), timeout)
+                    code, _ = await asyncio.wait_for(asyncio.gather(process.stdout.readline(),
+                                                                    process.stderr.readline()), timeout)
+                    result["stdout"] = out[:-len(marker)]
+                    result["stderr"] = err[:-len(marker)]
+                    result["exit_status"] = int(code)
+                    self.logger.debug(f"response code({code.strip()}) <RECEIVE>\n{result['stdout']}{result['stderr']}\n</RECEIVE>")
+                i = len(results)
+        except Exception as e:
+            msg = f"Exception caught- {type(e).__name__}: {e}"
+            self.logger.error(f"host ({self.host}) session {msg}")
+            for result in results[i:]:
+                result["stderr"] = msg
+
+        return results
+
+    def _start_transfer(self, name: str):
+        """Count the bytes of one transfer, return (progress_handler, finish)."""
+        copied = {}
+        start = time.monotonic()
+
+        def progress_handler(src_path, dst_path, done, total):
+            copied[src_path] = done
+
+        def finish() -> dict:
+            seconds = max(time.monotonic() - start, 1e-6)
+            size = sum(copied.values())
+            report = {"name": name, "bytes": size, "seconds": round(seconds, 3),
+                      "bytes_per_sec": round(size / seconds)}
+            self.transfer_report.append(report)
+            return report
+
+        return progress_handler, finish
+
     @cyl_wrapper.handle_exception
     async def scp(self, local_path, remote_path, download=False):
+        progress_handler, finish = self._start_transfer(os.path.basename(local_path if not download else remote_path))
+        async with self._channel():
+            if download:
+                await asyncssh.scp((self.conn, remote_path), local_path, preserve=True, recurse=True,
+                                   progress_handler=progress_handler)
+            else:
+                await asyncssh.scp([local_path], (self.conn, remote_path), preserve=True, recurse=True,
+                                   progress_handler=progress_handler)
         if download:
-            await asyncssh.scp((self.conn, remote_path), local_path, preserve=True, recurse=True)
             msg = f"download the file ({self.host}:{remote_path}) to ({local_path}) success!"
-            self.logger.info(msg)
         else:
-            await asyncssh.scp([local_path], (self.conn, remote_path), preserve=True, recurse=True)
             msg = f"upload the file ({local_path}) to ({self.host}:{remote_path}) success!"
-            self.logger.info(msg)
 
+        report = finish()
+        msg += f" ({report['bytes']} bytes, {report['bytes_per_sec']} B/s)"
+        self.logger.info(msg)
         return True, msg
 
-    async def transfer_process(self, files_config: CYLSCPConfig):
+    @cyl_wrapper.handle_exception
+    async def sftp(self, sftp_client: asyncssh.SFTPClient, local_path, remote_path, download=False,
+                   block_size: Optional[int]=None, max_requests: Optional[int]=None):
+        """Like scp() on an open SFTP client, max_requests read/write requests of block_size are in flight.
+
+        None (or -1) leaves the option to asyncssh, its own -1 "auto" needs asyncssh 2.14.
+        """
+
+        progress_handler, finish = self._start_transfer(os.path.basename(local_path if not download else remote_path))
+        options = {"preserve": True, "recurse": True, "progress_handler": progress_handler}
+        if block_size is not None and block_size > 0:
+            options["block_size"] = block_size
+        if max_requests is not None and max_requests > 0:
+            options["max_requests"] = max_requests
+        if download:
+            async with self._channel():
+                await sftp_client.mget(remote_path, local_path, **options)
+            msg = f"download the file ({self.host}:{remote_path}) to ({local_path}) success!"
+        else:
+            ## a name pattern goes to the folder of the target path
+            if any(c in os.path.basename(remote_path) for c in "*?["):
+                remote_path = os.path.dirname(remote_path) or "."
+            async with self._channel():
+                await sftp_client.mput(local_path, remote_path, **options)
+            msg = f"upload the file ({local_path}) to ({self.host}:{remote_path}) success!"
+
+        report = finish()
+        msg += f" ({report['bytes']} bytes, {report['bytes_per_sec']} B/s)"
+        self.logger.info(msg)
+        return True, msg
+
+    @staticmethod
+    def _pack_bundle(members, f) -> int:
+        def as_root(tarinfo):
+            tarinfo.uid = tarinfo.gid = 0
+            tarinfo.uname = tarinfo.gname = "root"
+            return tarinfo
+
+        with tarfile.open(fileobj=f, mode="w:gz") as tar:
+            for local_path, remote_path in members:
+                paths = [(local_path, remote_path)]
+                ## a name pattern goes to the folder of the target path
+                if any(c in os.path.basename(local_path) for c in "*?["):
+                    paths = [(path, posixpath.join(posixpath.dirname(remote_path), os.path.basename(path)))
+                             for path in sorted(glob.glob(local_path))]
+                for path, target in paths:
+                    tar.add(path, arcname=target.lstrip("/"), filter=as_root)
+        return f.tell()
+
+    @cyl_wrapper.handle_exception
+    async def bundle_upload(self, members, timeout: float=300):
+        """Upload the (local path, absolute remote path) members by one tar.gz stream.
+
+        The archive is packed to a temporary file and streamed to one
+        `tar -xzf - -C /` on the device, instead of a transfer per file.
+        """
+
+        loop = asyncio.get_running_loop()
+        progress_handler, finish = self._start_transfer(f"bundle of {len(members)} files")
+
+        async def send(f):
+            async with self._channel(), self.conn.create_process("tar -xzf - -C /", encoding=None) as process:
+                sent = 0
+                while chunk := await loop.run_in_executor(None, f.read, 1 << 16):
+                    process.stdin.write(chunk)
+                    await process.stdin.drain()
+                    sent += len(chunk)
+                    progress_handler(b"bundle", b"/", sent, size)
+                process.stdin.write_eof()
+                return await process.wait()
+
+        with tempfile.TemporaryFile() as f:
+            size = await loop.run_in_executor(None, CYLAsyncSSH._pack_bundle, members, f)
+            f.seek(0)
+            res = await asyncio.wait_for(send(f), timeout)
+
+        if res.exit_status != 0:
+            msg = f"host ({self.host}) unpack bundle code({res.exit_status}): {res.stderr.decode(errors='replace')}"
+            self.logger.error(msg)
+            return False, msg
+
+        report = finish()
+        msg = f"upload the bundle of {len(members)} files to ({self.host}) success! ({report['bytes']} bytes, {report['bytes_per_sec']} B/s)"
+        self.logger.info(msg)
+        return True, msg
+
+    @staticmethod
+    async def _async_local_md5(path, local_hashes: dict) -> str:
+        ## one hash per file content in a run, the hosts share the futures
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if key not in local_hashes:
+            local_hashes[key] = asyncio.get_running_loop().run_in_executor(None, cyl_util.file_md5, path)
+        return await local_hashes[key]
+
+    async def fetch_remote_md5(self, paths, timeout: float=30) -> dict:
+        """The {path: md5} of the remote files by one md5sum command, the missing files are left out."""
+
+        if not paths:
+            return {}
+        cmd = "md5sum " + " ".join(shlex.quote(path) for path in paths) + " 2>/dev/null; true"
+        ret, out = await self.run_cmd(cmd, timeout=timeout)
+        hashes = {}
+        if ret:
+            for line in out.splitlines():
+                md5, _, path = line.partition("  ")
+                if len(md5) == 32 and path:
+                    hashes[path] = md5
+        return hashes
+
+    async def resolve_remote_targets(self, file_dicts, timeout: float=10) -> list:
+        """The remote file path of every upload as scp writes it, None if it cannot be resolved.
+
+        A target path ending with '/' or naming a directory on the device
+        gets the file name, any other target path is the file itself. The
+        directories are checked by one command.
+        """
+
+        asking = sorted({file_dict["target_path"] for file_dict in file_dicts
+                         if not file_dict["target_path"].endswith("/")})
+        is_dir = {}
+        if asking:
+            cmd = ("for p in " + " ".join(shlex.quote(path) for path in asking)
+                   + '; do [ -d "$p" ] && echo d || echo f; done')
+            ret, out = await self.run_cmd(cmd, timeout=timeout)
+            answers = out.split() if ret else []
+            if len(answers) == len(asking):
+                is_dir = {path: answer == "d" for path, answer in zip(asking, answers)}
+            else:
+                self.logger.warning(f"host ({self.host}) cannot resolve the target paths: {out}")
+
+        paths = []
+        for file_dict in file_dicts:
+            target_path = file_dict["target_path"]
+            if target_path.endswith("/") or is_dir.get(target_path):
+                paths.append(posixpath.join(target_path, file_dict["name"]))
+            elif target_path in is_dir:
+                paths.append(target_path)
+            else:
+                paths.append(None)
+        return paths
+
+    async def transfer_process(self, files_config: CYLSCPConfig, local_hashes: dict=None, known_hashes: dict=None):
+        """Run the transfer of the config.
+
+        The optional config keys:
+          engine:          "scp" (default) or "sftp".
+          block_size:      SFTP request size in bytes, unset is the asyncssh default.
+          max_requests:    SFTP requests in flight per file, unset is the asyncssh default.
+          parallel_files:  files in flight at the same time (default 1). Only
+                           the files without pre_cmds/post_cmds overlap, a file
+                           with commands waits for the files before it.
+          delta:           upload only the files whose md5 differs from the
+                           device (default false), the sent files are verified,
+                           a sent file which cannot be verified fails. The
+                           commands of a skipped file still run.
+          bundle:          upload each run of consecutive files with a resolved
+                           absolute remote path as one tar.gz stream (default
+                           false), see bundle_upload(). Only the first file of
+                           a run may have pre_cmds and only the last post_cmds,
+                           so the commands keep their declared order.
+          bundle_timeout_sec: the deadline of the bundle stream (default 300).
+
+        local_hashes: the local md5 cache shared by the hosts of one run.
+        known_hashes: the {remote path: md5} trusted without asking the device.
+        """
 
         self.logger.debug(json.dumps(files_config.__dict__, indent=4, ensure_ascii=False))
         action = files_config.config_type
@@ -199,6 +482,16 @@ class CYLAsyncSSH(object):
             self.logger.error(msg)
             raise ValueError(msg)
 
+        engine = getattr(files_config, "engine", "scp")
+        block_size = getattr(files_config, "block_size", None)
+        max_requests = getattr(files_config, "max_requests", None)
+        parallel_files = max(1, getattr(files_config, "parallel_files", 1))
+        delta = bool(getattr(files_config, "delta", False)) and action == "upload"
+        bundle = bool(getattr(files_config, "bundle", False)) and action == "upload"
+        bundle_timeout = getattr(files_config, "bundle_timeout_sec", 300)
+        self.transfer_report = []
+        self.delta_report = {"skipped": [], "sent": [], "verified": []}
+        self.file_hashes = {}
 
         async def run_cmd_list(cmd_list):
             failed_cmds_list = []
@@ -239,50 +532,196 @@ class CYLAsyncSSH(object):
         if len(files_dict_list) == 0:
             msg = f"Nothing need to {action}!"
 
-        for file_dict in files_dict_list:
+        ## the remote file of every upload, a directory target gets the file name
+        remote_files = {}
+        if delta or bundle:
+            resolved = await self.resolve_remote_targets(files_dict_list)
+            remote_files = {(file_dict["target_path"], file_dict["name"]): path
+                            for file_dict, path in zip(files_dict_list, resolved) if path}
+
+        def remote_file_of(file_dict):
+            return remote_files.get((file_dict["target_path"], file_dict["name"]))
+
+        ## Delta: the local hashes and the remote hashes of all targets in one command
+        local_md5, remote_md5 = {}, {}
+        if delta:
+            local_hashes = local_hashes if local_hashes is not None else {}
+            known_hashes = known_hashes or {}
+            targets = {}
+            for file_dict in files_dict_list:
+                file_path = os.path.join(file_dict["folder"], file_dict["name"])
+                if os.path.isfile(file_path) and remote_file_of(file_dict):
+                    targets[file_path] = remote_file_of(file_dict)
+            hashes = await asyncio.gather(*(self._async_local_md5(path, local_hashes) for path in targets))
+            local_md5 = dict(zip(targets, hashes))
+            remote_md5 = {target: known_hashes[target] for path, target in targets.items()
+                          if known_hashes.get(target) == local_md5[path]}
+            remote_md5.update(await self.fetch_remote_md5([target for target in targets.values()
+                                                           if target not in remote_md5]))
+
+        def file_path_of(file_dict):
+            return os.path.join(file_dict["folder"], file_dict["name"])
+
+        def is_up_to_date(file_dict) -> bool:
+            file_md5 = local_md5.get(file_path_of(file_dict))
+            remote_file = remote_file_of(file_dict)
+            if file_md5 and remote_md5.get(remote_file) == file_md5:
+                self.logger.info(f"host ({self.host}) file ({file_dict['name']}) is up to date, skip sending.")
+                self.delta_report["skipped"].append(file_dict["name"])
+                self.file_hashes[remote_file] = file_md5
+                return True
+            return False
+
+        def check_sent_md5(file_dict, sent_md5) -> bool:
+            ## under delta a sent file must have the local md5, an unreadable md5 fails too
+            file_md5 = local_md5.get(file_path_of(file_dict))
+            remote_file = remote_file_of(file_dict)
+            if remote_file:
+                self.file_hashes[remote_file] = sent_md5 or ""
+            if sent_md5 and sent_md5 == file_md5:
+                self.delta_report["verified"].append(file_dict["name"])
+                return True
+            if sent_md5:
+                self.logger.warning(f"host ({self.host}) file ({remote_file}) md5 {sent_md5} != {file_md5}!")
+                return False
+            self.logger.warning(f"host ({self.host}) cannot read the md5 of ({remote_file or file_dict['target_path']}), not verified.")
+            return False
+
+        async def finish_file(file_dict):
+            target_path = file_dict["target_path"]
+            ## chmod
+            if mod := file_dict.get('chmod'):
+                cmd = f"chmod {mod} {target_path}"
+                ret, out = await run_cmd_list([{"cmd": cmd}])
+                if ret is False:
+                    self.logger.warning(f"host ({self.host}) change mode {target_path}: {ret}, {out}")
+                    return
+
+            ## do post_cmds
+            ret, out = await run_cmd_list(file_dict.get("post_cmds"))
+            if not ret:
+                self.logger.warning(f"host ({self.host}) post_cmds failed: {out}")
+                return
+
+            really_transmit_files.append(file_dict["name"])
+            self.logger.info(f"host ({self.host}) {action} file ({file_dict['name']}) success!")
+
+        async def transfer_file(file_dict):
 
             self.logger.info(f"host ({self.host}) {action} file ({file_dict['name']})...")
 
             ## do pre_cmds
             ret, out = await run_cmd_list(file_dict.get("pre_cmds"))
             if not ret:
-                msg = f"host ({self.host}) pre_cmds failed: {out}"
-                self.logger.warning(msg)
-                continue
-            
+                self.logger.warning(f"host ({self.host}) pre_cmds failed: {out}")
+                return
+
             target_path = file_dict["target_path"]
             ## Sending File
-            file_path = os.path.join(file_dict["folder"], file_dict["name"])
+            file_path = file_path_of(file_dict)
 
-            if action == "upload":
-                # abs_file_path = os.path.abspath(file_path)
-                ret, out = await self.scp(file_path, target_path)
-            elif action == "download":
+            local_path, remote_path, download = file_path, target_path, False
+            if action == "download":
                 target_dir = os.path.dirname(target_path)
                 os.makedirs(target_dir, exist_ok=True)
+                local_path, remote_path, download = target_path, file_path, True
 
-                ret, out = await self.scp(target_path, file_path, True)
+            if not is_up_to_date(file_dict):
+                if sftp_client:
+                    ret, out = await self.sftp(sftp_client, local_path, remote_path, download, block_size, max_requests)
+                else:
+                    ret, out = await self.scp(local_path, remote_path, download)
 
-            if ret is False:
-                self.logger.warning(f"host ({self.host}) {action} file ({file_dict['name']}) failed: {out}!")
-                continue
-            ## chmod
-            if mod := file_dict.get('chmod'):
-                cmd = f"chmod {mod} {target_path}"
-                ret, out = await run_cmd_list([{"cmd": cmd}])
                 if ret is False:
-                    self.logger.warning(f"host ({self.host}) change mode {target_path}: {ret}, {out}")
+                    self.logger.warning(f"host ({self.host}) {action} file ({file_dict['name']}) failed: {out}!")
+                    return
+                if delta:
+                    self.delta_report["sent"].append(file_dict["name"])
+
+                ## Verify
+                if delta and os.path.isfile(file_path):
+                    remote_file = remote_file_of(file_dict)
+                    sent_md5 = (await self.fetch_remote_md5([remote_file])).get(remote_file) if remote_file else None
+                    if not check_sent_md5(file_dict, sent_md5):
+                        return
+
+            await finish_file(file_dict)
+
+        async def bundle_files(file_dicts):
+            ## the pre_cmds, one stream for all files, then chmod and post_cmds file by file
+            ready = []
+            for file_dict in file_dicts:
+                self.logger.info(f"host ({self.host}) bundle file ({file_dict['name']})...")
+                ret, out = await run_cmd_list(file_dict.get("pre_cmds"))
+                if not ret:
+                    self.logger.warning(f"host ({self.host}) pre_cmds failed: {out}")
                     continue
+                ready.append(file_dict)
 
-            ## do post_cmds
-            ret, out = await run_cmd_list(file_dict.get("post_cmds"))
-            if not ret:
-                msg = f"host ({self.host}) post_cmds failed: {out}"
-                self.logger.warning(msg)
-                continue
+            sending = [file_dict for file_dict in ready if not is_up_to_date(file_dict)]
+            if sending:
+                members = [(file_path_of(file_dict), remote_file_of(file_dict)) for file_dict in sending]
+                ret, out = await self.bundle_upload(members, timeout=bundle_timeout)
+                if ret is False:
+                    self.logger.warning(f"host ({self.host}) bundle {[f['name'] for f in sending]} failed: {out}!")
+                    return
+                if delta:
+                    self.delta_report["sent"] += [file_dict["name"] for file_dict in sending]
+
+                ## Verify all in one command
+                checked = [file_dict for file_dict in sending if file_path_of(file_dict) in local_md5]
+                sent_md5 = await self.fetch_remote_md5([remote_file_of(file_dict) for file_dict in checked])
+                failed = [file_dict for file_dict in checked
+                          if not check_sent_md5(file_dict, sent_md5.get(remote_file_of(file_dict)))]
+                ready = [file_dict for file_dict in ready if all(file_dict is not f for f in failed)]
+
+            for file_dict in ready:
+                await finish_file(file_dict)
+
+        def bundleable(file_dict) -> bool:
+            ## the archive member needs the remote file, an unresolved target goes by file
+            remote_file = remote_file_of(file_dict)
+            return bundle and bool(remote_file) and posixpath.isabs(remote_file)
+
+        ## in declared order: a run of bundleable files goes as one stream, a run
+        ## of files without commands overlaps, the others go one by one
+        groups = []
+        for file_dict in files_dict_list:
+            if bundleable(file_dict):
+                kind = "bundle"
+                joins = (groups and groups[-1][0] == kind
+                         and not groups[-1][1][-1].get("post_cmds") and not file_dict.get("pre_cmds"))
+            else:
+                independent = not file_dict.get("pre_cmds") and not file_dict.get("post_cmds")
+                kind = "parallel" if independent else "serial"
+                joins = independent and groups and groups[-1][0] == kind
+            if joins:
+                groups[-1][1].append(file_dict)
+            else:
+                groups.append((kind, [file_dict]))
+
+        sftp_client = None
+        if engine == "sftp" and any(kind != "bundle" for kind, _ in groups):
+            try:
+                async with self._channel():
+                    sftp_client = await self.conn.start_sftp_client()
+            except Exception as e:
+                self.logger.warning(f"host ({self.host}) start sftp Exception caught- {type(e).__name__}: {e}, use scp.")
 
-            really_transmit_files.append(file_dict["name"])
-            self.logger.info(f"host ({self.host}) {action} file ({file_dict['name']}) success!")
+        semaphore = asyncio.Semaphore(parallel_files)
+        async def transfer_bounded(file_dict):
+            async with semaphore:
+                await transfer_file(file_dict)
+
+        try:
+            for kind, group in groups:
+                if kind == "bundle":
+                    await bundle_files(group)
+                else:
+                    await asyncio.gather(*(transfer_bounded(file_dict) for file_dict in group))
+        finally:
+            if sftp_client:
+                sftp_client.exit()
 
         ## sync
         await self.run_cmd("echo sync; sync")
@@ -300,22 +739,38 @@ class CYLAsyncSSH(object):
             msg = f"host ({self.host}) {action} failed files:{diff_list}"
             self.logger.warning(msg)
             return False, msg
+
+        if delta:
+            msg = (f"{msg} (skipped {len(self.delta_report['skipped'])}, sent {len(self.delta_report['sent'])}, "
+                   f"verified {len(self.delta_report['verified'])})")
+        if self.transfer_report:
+            rates = ", ".join(f"{r['name']} {r['bytes_per_sec']} B/s" for r in self.transfer_report)
+            msg = f"{msg} ({rates})"
         return True, msg
 
 
-    async def close(self):
+    async def close(self, discard: bool=False):
+        """Close the connection, or give it back to the pool, discarded if it broke."""
         if self.conn:
-            self.conn.close()
+            if self.pool is not None:
+                self.pool.release(self.conn, discard=discard or self.broken)
+            else:
+                self.conn.close()
             self.conn = None
 
 ## ====================================================
 ## single host, multi commands
 ## ====================================================
 
-async def async_send_cmd_list(host, username, password, cmd_list, port=22, **kwargs):
+async def async_send_cmd_list(host, username, password, cmd_list, port=22, pool: CYLSSHPool=None, session: bool=False,
+                              started=None, **kwargs):
+    """session=True runs the whole list in one remote shell instead of one exec channel per command,
+    started() is called once the connection is up (see CYLFleetScheduler)."""
 
-    mySSH = CYLAsyncSSH()
+    mySSH = CYLAsyncSSH(pool=pool)
     await mySSH.connect(host, username, password, port=port)
+    if started:
+        started()
 
     all_cmd_result = []
     if not mySSH.is_connected():
@@ -324,6 +779,11 @@ async def async_send_cmd_list(host, username, password, cmd_list, port=22, **kwa
             res_dict['cmd'] = cmd
             res_dict['result'] = (False, f"host ({host}): Cannot connect!")
             all_cmd_result.append(res_dict)
+    elif session:
+        for result in await mySSH.run_session(cmd_list, timeout=kwargs.get("timeout", 10)):
+            ret = result["exit_status"] == 0
+            all_cmd_result.append({'cmd': result["cmd"],
+                                   'result': (ret, result["stdout"] if ret else result["stderr"])})
     else:
         for cmd in cmd_list:
             res_dict = {}
@@ -343,20 +803,16 @@ async def async_send_cmd_list(host, username, password, cmd_list, port=22, **kwa
 ## The variable remote_hosts is a list of dictionaries, where each dictionary must contain the key "ip".
 ## ex. [{"ip": 192.168.2.10}, {"ip": 192.168.2.55}]
 
-async def send_ssh_cmds(remote_hosts: List[dict], username, password, cmd_list, port=22, **kwargs):
+async def send_ssh_cmds(remote_hosts: List[dict], username, password, cmd_list, port=22, pool: CYLSSHPool=None,
+                        scheduler: CYLFleetScheduler=None, **kwargs):
 
-    tasks = []
-    for host in remote_hosts:
-        task = async_send_cmd_list(host['ip'], username, password, cmd_list=cmd_list, port=port, **kwargs)
-        tasks.append(task)
-    
-    # Waiting for all process done
-    res_dict = dict()
-    results = await asyncio.gather(*tasks)
-    for i, res in enumerate(results):
-        res_dict[remote_hosts[i]['ip']] = res
+    async def job(host, started):
+        return await async_send_cmd_list(host['ip'], username, password, cmd_list=cmd_list, port=port, pool=pool,
+                                         started=started, **kwargs)
 
-    return res_dict
+    # Waiting for all process done, the connection starts are bounded by the scheduler
+    scheduler = scheduler or CYLFleetScheduler()
+    return await scheduler.async_run(remote_hosts, job)
 
 ## ========================================================
 ## scp multi hosts
@@ -364,12 +820,21 @@ async def send_ssh_cmds(remote_hosts: List[dict], username, password, cmd_list,
 ## The variable remote_hosts is a list of dictionaries, where each dictionary must contain the key "ip".
 ## ex. [{"ip": 192.168.2.10}, {"ip": 192.168.2.55}]
 
-async def scp_process(username, password, remote_hosts: List[dict], action="upload", target_folder="storage", config_name="", host_config_variables={}):
+async def scp_process(username, password, remote_hosts: List[dict], action="upload", target_folder="storage", config_name="", host_config_variables={}, pool: CYLSSHPool=None,
+                      scheduler: CYLFleetScheduler=None, inventory: CYLInventory=None):
+    """inventory keeps the remote file hashes per MAC for the delta uploads.
+
+    The max_hosts / max_per_subnet / subnet_prefix / start_rate of the config
+    JSON override the limits of scheduler for this run.
+    """
 
     if not config_name:
         config_name = action
+
+    ## every local file is hashed once per run
+    local_hashes = {}
     
-    async def update_device(host, username, password, action="upload", host_config_variables={}):
+    async def update_device(host, username, password, action="upload", host_config_variables={}, started=None):
 
         config_path = os.path.join(f'{target_folder}', f'{config_name}.json')
 
@@ -384,13 +849,23 @@ async def scp_process(username, password, remote_hosts: List[dict], action="uplo
         if host.get('model-id') is not None:
             config_variables["MODEL"] = host.get('model-id')
 
-        mySSH = CYLAsyncSSH()
+        mySSH = CYLAsyncSSH(pool=pool)
         await mySSH.connect(host['ip'], username, password)
+        if started:
+            started()
         if not mySSH.is_connected():
             return False, f"host ({host['ip']}): Cannot connect!"
 
-        ret, out = await mySSH.transfer_process(CYLSCPConfig(config_path, action, config_variables))
+        files_config = CYLSCPConfig(config_path, action, config_variables)
+        mac = host.get('mac') or ""
+        known_hashes = None
+        if inventory is not None and mac and (max_age := getattr(files_config, "delta_cache_sec", 0)):
+            known_hashes = inventory.get_file_hashes(mac, max_age)
+
+        ret, out = await mySSH.transfer_process(files_config, local_hashes, known_hashes)
         await mySSH.close()
+        if inventory is not None and mac:
+            inventory.record_file_hashes(mac, mySSH.file_hashes)
         if ret:
             mySSH.logger.info(f"host ({host['ip']}): ret: {ret}, out: {out}")
             mySSH.logger.info(cyl_util.success_sign)
@@ -400,19 +875,15 @@ async def scp_process(username, password, remote_hosts: List[dict], action="uplo
 
         return ret, out
 
-    tasks = []
-    for host in remote_hosts:
-        task = update_device(host, username, password, action, host_config_variables)
-        tasks.append(task)
-    
-    # Waiting for all process done
-    res_dict = dict()
-    results = await asyncio.gather(*tasks)
-    failed_hosts = []
-    for i, res in enumerate(results):
-        res_dict[remote_hosts[i]['ip']] = res
-        if not res[0]:
-            failed_hosts.append(remote_hosts[i]['ip'])
+    async def job(host, started):
+        return await update_device(host, username, password, action, host_config_variables, started)
+
+    # Waiting for all process done, the connection starts are bounded by the scheduler
+    config_path = os.path.join(f'{target_folder}', f'{config_name}.json')
+    config = cyl_util.load_config_json(config_path) if os.path.isfile(config_path) else None
+    scheduler = CYLFleetScheduler.from_config(config, scheduler)
+    res_dict = await scheduler.async_run(remote_hosts, job)
+    failed_hosts = [ip for ip, res in res_dict.items() if not res[0]]
 
     print(f"failed_hosts: {failed_hosts}")
     
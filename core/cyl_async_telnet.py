@@ -48,8 +48,9 @@ class CYLAsyncTelnet(object):
     @classmethod
     async def async_waitUntilConnect(cls, ip: str = "192.168.2.200",
                                     port: int = 23,
-                                    timeout: float = 5):
-        """Try to connect the host until timeout"""
+                                    timeout: float = 5,
+                                    expect_string: str = None):
+        """Try to connect the host until timeout, expect_string ends the port 23 banner (default EPILOG)"""
 
         start_time = time.time()
         while (time.time() - start_time < timeout):
@@ -61,7 +62,7 @@ class CYLAsyncTelnet(object):
                 _LOGGER.debug("Dut connection takes time : {t}"\
                                 .format(t=(time.time() - start_time)))
                 if port == 23:
-                    await dut.response(timeout=2)
+                    await dut.response(timeout=2, expect_string=expect_string)
 
                 return dut
             await asyncio.sleep(0.5)
@@ -241,7 +242,7 @@ def telnet_send(host, port, cmd, **kwargs):
 @cyl_wrapper.run_time
 async def async_telnet_send(host, port, cmd, **kwargs):
 
-    myTelnet = await CYLAsyncTelnet.async_waitUntilConnect(host, port)
+    myTelnet = await CYLAsyncTelnet.async_waitUntilConnect(host, port, expect_string=kwargs.get("expect_string"))
     if not myTelnet:
         return False, f"host ({host}): Cannot connect!"
         
@@ -297,6 +298,22 @@ async def async_send_cmd_list(host, port, cmd_list, **kwargs):
 ## The variable remote_hosts is a list of dictionaries, where each dictionary must contain the key "ip" and "mac".
 ## ex. [{"ip": 192.168.2.10, "mac": "D0:14:11:B0:02:19"}, {"ip": 192.168.2.55, "mac": "D0:14:11:B0:02:45"}]
 
+def make_9528cmd_list(host, cmd_template_list, channel_list=[1]):
+    """Fill the target-id of the cmd templates for the host"""
+
+    cmd_list = []
+    for cmd_template in cmd_template_list:
+        cmd_dict = cyl_util.content9528_to_dict(cmd_template)
+        if cmd_dict.get("target-id"):
+            for ch in channel_list:
+                cmd_dict["target-id"] = cyl_util.make_target_id(host['mac'], ch)
+                cmd = '#:' + json.dumps(cmd_dict) + ':#'
+                cmd_list.append(cmd)
+        else:
+            cmd = cmd_template
+            cmd_list.append(cmd)
+    return cmd_list
+
 ## Notice!!! The function send_telnet_23cmds() and send_telnet_9528cmds() will change the global telnet config of EPILOG !!
 
 async def send_telnet_23cmds(remote_hosts, cmd_list, **kwargs):
@@ -325,18 +342,7 @@ async def send_telnet_9528cmds(remote_hosts, cmd_template_list, channel_list=[1]
 
     tasks = []
     for host in remote_hosts:
-        cmd_list = []
-        for cmd_template in cmd_template_list:
-            cmd_dict = cyl_util.content9528_to_dict(cmd_template)
-            if cmd_dict.get("target-id"):
-                for ch in channel_list:
-                    cmd_dict["target-id"] = cyl_util.make_target_id(host['mac'], ch)
-                    cmd = '#:' + json.dumps(cmd_dict) + ':#'
-                    cmd_list.append(cmd)
-            else:
-                cmd = cmd_template
-                cmd_list.append(cmd)
-
+        cmd_list = make_9528cmd_list(host, cmd_template_list, channel_list)
         task = async_send_cmd_list(host['ip'], port=9528, cmd_list=cmd_list, **kwargs)
         tasks.append(task)
     
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from ipaddress import ip_interface
+from typing import Any, Awaitable, Callable, Dict, List
+
+_LOGGER = logging.getLogger(__name__)
+_LOGGER.setLevel(logging.DEBUG)
+
+
+class CYLFleetScheduler(object):
+    """Run one job per host with bounded fan-out.
+
+    max_hosts:       jobs running at the same time over the whole fleet,
+                     i.e. the open SSH sessions.
+    max_per_subnet:  hosts connecting at the same time in one /subnet_prefix,
+                     the hosts of a subnet share a switch.
+    start_rate:      hosts started per second, every start opens a connection.
+
+    A job holds its fleet slot until it ends. The subnet slot bounds only
+    the start: job(host, started) calls started() once its connection is
+    up, which frees the subnet slot for the next handshake while the rest
+    of the job (e.g. a long OTA transfer) runs on. A job that never calls
+    started() holds its subnet slot until it ends.
+
+    A job takes its start-rate turn before the slots, so nothing sleeps
+    while holding a slot.
+    """
+
+    ## the keys of a config (SCP setting / SCP config JSON) for the limits
+    CONFIG_KEYS = ("max_hosts", "max_per_subnet", "subnet_prefix", "start_rate")
+
+    def __init__(self,
+                 max_hosts: int=64,
+                 max_per_subnet: int=16,
+                 subnet_prefix: int=24,
+                 start_rate: float=20):
+        self.max_hosts = max_hosts
+        self.max_per_subnet = max_per_subnet
+        self.subnet_prefix = subnet_prefix
+        self.start_rate = start_rate
+
+    @classmethod
+    def from_config(cls, config: dict, base: "CYLFleetScheduler"=None) -> "CYLFleetScheduler":
+        """Build a scheduler from the limits of config, the missing ones come from base."""
+
+        base = base or cls()
+        limits = {key: getattr(base, key) for key in cls.CONFIG_KEYS}
+        for key in cls.CONFIG_KEYS:
+            if (config or {}).get(key) is not None:
+                limits[key] = config[key]
+        return cls(**limits)
+
+    def subnet_of(self, ip: str) -> str:
+        try:
+            return str(ip_interface(f"{ip}/{self.subnet_prefix}").network)
+        except ValueError:
+            ## a host name is its own subnet
+            return ip
+
+    async def async_run(self,
+                        remote_hosts: List[dict],
+                        job: Callable[[dict, Callable[[], None]], Awaitable[Any]]) -> Dict[str, Any]:
+        """Run job(host, started) for every host under the limits, return {ip: result}."""
+
+        loop = asyncio.get_running_loop()
+        fleet = asyncio.Semaphore(max(1, int(self.max_hosts)))
+        subnets: Dict[str, asyncio.Semaphore] = {}
+        next_start = loop.time()
+
+        async def wait_start():
+            nonlocal next_start
+            if not self.start_rate:
+                return
+            now = loop.time()
+            delay = next_start - now
+            next_start = max(now, next_start) + 1 / self.start_rate
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        async def run(host):
+            subnet = subnets.setdefault(self.subnet_of(host['ip']),
+                                        asyncio.Semaphore(max(1, int(self.max_per_subnet))))
+            await wait_start()
+            async with fleet:
+                await subnet.acquire()
+                starting = True
+
+                def started():
+                    nonlocal starting
+                    if starting:
+                        starting = False
+                        subnet.release()
+
+                try:
+                    return await job(host, started)
+                finally:
+                    started()
+
+        _LOGGER.debug(f"fleet: {len(remote_hosts)} hosts, max {self.max_hosts} hosts, "
+                      f"{self.max_per_subnet} connecting per subnet, {self.start_rate} starts/sec")
+        results = await asyncio.gather(*(run(host) for host in remote_hosts))
+
+        res_dict = dict()
+        for i, res in enumerate(results):
+            res_dict[remote_hosts[i]['ip']] = res
+        return res_dict
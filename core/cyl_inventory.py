@@ -0,0 +1,196 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterator, List
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_INVENTORY_PATH = os.path.join("recall", "inventory.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    mac         TEXT PRIMARY KEY,
+    ip          TEXT NOT NULL DEFAULT '',
+    info        TEXT NOT NULL DEFAULT '{}',
+    first_seen  REAL NOT NULL,
+    last_seen   REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scp_results (
+    mac         TEXT NOT NULL,
+    ip          TEXT NOT NULL,
+    time        REAL NOT NULL,
+    action      TEXT NOT NULL,
+    config      TEXT NOT NULL,
+    result      INTEGER NOT NULL,
+    message     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scp_results_mac ON scp_results (mac);
+CREATE TABLE IF NOT EXISTS file_hashes (
+    mac         TEXT NOT NULL,
+    path        TEXT NOT NULL,
+    hash        TEXT NOT NULL,
+    time        REAL NOT NULL,
+    PRIMARY KEY (mac, path)
+);
+"""
+
+
+class CYLInventory(object):
+    """Device inventory keyed by MAC on a SQLite file.
+
+    The records are staged in memory and written in one transaction per
+    `batch_size` records or on flush(), it is safe to use from threads.
+    """
+
+    def __init__(self, db_path: str=DEFAULT_INVENTORY_PATH, batch_size: int=50):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._pending_devices = {}
+        self._pending_scp = []
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.executescript(_SCHEMA)
+
+    @staticmethod
+    def _mac_key(mac: str) -> str:
+        return mac.upper()
+
+    def record_device(self, host: dict, info: dict=None, seen: float=None):
+        """Stage a device seen by a scan and/or its device info."""
+
+        mac = host.get("mac", "")
+        if not mac:
+            return
+        seen = time.time() if seen is None else seen
+        with self._lock:
+            key = self._mac_key(mac)
+            pending = self._pending_devices.setdefault(key, {"ip": "", "info": {}, "seen": seen})
+            pending["ip"] = host.get("ip") or pending["ip"]
+            pending["seen"] = seen
+            if info:
+                pending["info"].update(info)
+            if len(self._pending_devices) >= self.batch_size:
+                self._flush_locked()
+
+    def record_devices(self, hosts: List[dict], infos: dict=None):
+        """Stage the devices, infos is a dict of ip to device info."""
+
+        infos = infos or {}
+        for host in hosts:
+            self.record_device(host, infos.get(host.get("ip")))
+
+    def record_scp_result(self, host: dict, action: str, config: str, result: tuple):
+        with self._lock:
+            self._pending_scp.append((self._mac_key(host.get("mac", "")),
+                                      host.get("ip", ""),
+                                      time.time(),
+                                      action,
+                                      config,
+                                      int(bool(result[0])),
+                                      str(result[1])))
+            if len(self._pending_scp) >= self.batch_size:
+                self._flush_locked()
+
+    def flush(self):
+        """Write the staged records in one transaction."""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending_devices and not self._pending_scp:
+            return
+
+        macs = list(self._pending_devices)
+        stored = {}
+        for i in range(0, len(macs), 500):
+            chunk = macs[i:i+500]
+            rows = self.conn.execute(
+                f"SELECT mac, info FROM devices WHERE mac IN ({','.join('?'*len(chunk))})", chunk)
+            stored.update({row["mac"]: json.loads(row["info"]) for row in rows})
+
+        device_rows = []
+        for mac, pending in self._pending_devices.items():
+            info = stored.get(mac, {})
+            info.update(pending["info"])
+            device_rows.append((mac, pending["ip"], json.dumps(info, ensure_ascii=False),
+                                pending["seen"], pending["seen"]))
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO devices (mac, ip, info, first_seen, last_seen) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(mac) DO UPDATE SET "
+                "ip = CASE WHEN excluded.ip != '' THEN excluded.ip ELSE devices.ip END, "
+                "info = excluded.info, "
+                "last_seen = MAX(devices.last_seen, excluded.last_seen)",
+                device_rows)
+            self.conn.executemany(
+                "INSERT INTO scp_results (mac, ip, time, action, config, result, message) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                self._pending_scp)
+
+        _LOGGER.debug(f"inventory flush {len(device_rows)} devices, {len(self._pending_scp)} scp results")
+        self._pending_devices = {}
+        self._pending_scp = []
+
+    @staticmethod
+    def _row_to_device(row) -> dict:
+        return {"mac": row["mac"],
+                "ip": row["ip"],
+                "info": json.loads(row["info"]),
+                "first_seen": row["first_seen"],
+                "last_seen": row["last_seen"]}
+
+    def _query(self, sql: str, parameters=()) -> list:
+        with self._lock:
+            self._flush_locked()
+            return self.conn.execute(sql, parameters).fetchall()
+
+    def get_device(self, mac: str) -> dict:
+        rows = self._query("SELECT * FROM devices WHERE mac = ?", (self._mac_key(mac),))
+        return self._row_to_device(rows[0]) if rows else None
+
+    def iter_devices(self, batch_size: int=100) -> Iterator[List[dict]]:
+        """Yield the devices batch by batch, the most recently seen first."""
+        offset = 0
+        while rows := self._query("SELECT * FROM devices ORDER BY last_seen DESC, mac LIMIT ? OFFSET ?",
+                                  (batch_size, offset)):
+            offset += len(rows)
+            yield [self._row_to_device(row) for row in rows]
+
+    def get_scp_results(self, mac: str) -> List[dict]:
+        rows = self._query("SELECT * FROM scp_results WHERE mac = ? ORDER BY time",
+                           (self._mac_key(mac),))
+        return [dict(row) for row in rows]
+
+    def record_file_hashes(self, mac: str, hashes: dict, seen: float=None):
+        """Save the known {remote path: md5} of the device, an empty hash forgets the path."""
+
+        if not mac or not hashes:
+            return
+        seen = time.time() if seen is None else seen
+        key = self._mac_key(mac)
+        with self._lock, self.conn:
+            self.conn.executemany("DELETE FROM file_hashes WHERE mac = ? AND path = ?",
+                                  [(key, path) for path, md5 in hashes.items() if not md5])
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO file_hashes (mac, path, hash, time) VALUES (?, ?, ?, ?)",
+                [(key, path, md5, seen) for path, md5 in hashes.items() if md5])
+
+    def get_file_hashes(self, mac: str, max_age: float=None) -> dict:
+        """The {remote path: md5} of the device saved in the last max_age seconds."""
+
+        since = time.time() - max_age if max_age is not None else 0
+        rows = self._query("SELECT path, hash FROM file_hashes WHERE mac = ? AND time >= ?",
+                           (self._mac_key(mac), since))
+        return {row["path"]: row["hash"] for row in rows}
+
+    def close(self):
+        self.flush()
+        self.conn.close()
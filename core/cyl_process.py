@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import os
+import signal
+import subprocess
+import sys
+import weakref
+from typing import Callable, List, Optional, Tuple
+
+_LOGGER = logging.getLogger(__name__)
+
+CREATE_NO_WINDOW = 0x08000000
+
+
+class CYLProcessRunner(object):
+    """Run the external tools under a true deadline.
+
+    Every child gets its own process group (session on POSIX), so the
+    whole group is killed on timeout or cancel, the stdout lines are
+    handed out as soon as they are printed and at most `max_processes`
+    children run at the same time per event loop.
+    """
+
+    def __init__(self, max_processes: int=16):
+        self.max_processes = max_processes
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        ## the GUI runs one event loop per action, a semaphore is bound to one loop
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_processes)
+        return self._semaphores[loop]
+
+    @staticmethod
+    async def _async_spawn(program: str, *args) -> asyncio.subprocess.Process:
+        if sys.platform == "win32":
+            return await asyncio.create_subprocess_exec(
+                program, *args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                creationflags=CREATE_NO_WINDOW | subprocess.CREATE_NEW_PROCESS_GROUP)
+
+        return await asyncio.create_subprocess_exec(
+            program, *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True)
+
+    @staticmethod
+    async def _async_kill(process: asyncio.subprocess.Process):
+        """Kill the process group of the child, its grandchildren may still hold the pipes."""
+        try:
+            if sys.platform == "win32":
+                if process.returncode is None:
+                    killer = await asyncio.create_subprocess_exec(
+                        "taskkill", "/F", "/T", "/PID", str(process.pid),
+                        stdout=asyncio.subprocess.DEVNULL,
+                        stderr=asyncio.subprocess.DEVNULL,
+                        creationflags=CREATE_NO_WINDOW)
+                    await killer.wait()
+            else:
+                os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        except OSError as e:
+            _LOGGER.warning(f"kill process group ({process.pid}) failed: {e}")
+            if process.returncode is None:
+                process.kill()
+        await process.wait()
+
+    async def async_stream(self,
+                           program: str,
+                           *args,
+                           timeout: float=10,
+                           on_line: Optional[Callable[[str], None]]=None) -> Tuple[bool, str]:
+        """Run the program and call on_line for every stdout line.
+
+        Return (True, stderr) if it exits before the deadline, else
+        (False, 'Process timed out') after killing its process group.
+        The deadline starts when the child is spawned, not while it
+        waits for a free slot.
+        """
+
+        async with self._get_semaphore():
+            process = await self._async_spawn(program, *args)
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + timeout
+            stderr_task = asyncio.create_task(process.stderr.read())
+            finished = False
+            try:
+                while True:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError
+                    line = await asyncio.wait_for(process.stdout.readline(), remaining)
+                    if not line:
+                        break
+                    if on_line is not None:
+                        on_line(line.decode('utf-8', 'ignore').rstrip('\r\n'))
+
+                await asyncio.wait_for(process.wait(), max(0, deadline - loop.time()))
+                finished = True
+                return True, (await stderr_task).decode('utf-8', 'ignore').strip()
+            except asyncio.TimeoutError:
+                _LOGGER.error(f"{program} {' '.join(args)} timed out ({timeout} sec)")
+                return False, 'Process timed out'
+            finally:
+                if not finished:
+                    await self._async_kill(process)
+                stderr_task.cancel()
+
+    async def async_run(self, program: str, *args, timeout: float=10,
+                        on_line: Optional[Callable[[str], None]]=None) -> Tuple[bool, str]:
+        """Run subprocess and get response.
+
+        Return (True, stdout) when it exits before the deadline, else
+        (False, stdout) with the output printed before the timeout.
+        """
+
+        lines: List[str] = []
+
+        def collect(line: str):
+            lines.append(line)
+            if on_line is not None:
+                on_line(line)
+
+        ret, _ = await self.async_stream(program, *args, timeout=timeout, on_line=collect)
+        return ret, "\n".join(lines).strip()
+
+    async def async_iter_lines(self, program: str, *args, timeout: float=10):
+        """Yield the stdout lines as soon as they are printed.
+
+        Leaving the loop early kills the process group.
+        """
+
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        async def run():
+            try:
+                await self.async_stream(program, *args, timeout=timeout, on_line=queue.put_nowait)
+            finally:
+                queue.put_nowait(done)
+
+        task = asyncio.create_task(run())
+        try:
+            while (line := await queue.get()) is not done:
+                yield line
+            await task
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+
+PROCESS_RUNNER = CYLProcessRunner()
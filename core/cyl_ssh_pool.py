@@ -0,0 +1,188 @@
+import asyncio
+import contextlib
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+import asyncssh
+
+_LOGGER = logging.getLogger(__name__)
+_LOGGER.setLevel(logging.DEBUG)
+
+
+class _PooledConnection(object):
+
+    def __init__(self, conn: asyncssh.SSHClientConnection):
+        self.conn = conn
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.users = 0
+        self.retired = False
+        self.idle_handle: Optional[asyncio.TimerHandle] = None
+
+
+class CYLSSHPool(object):
+    """Share the SSH connections of the hosts between the actions.
+
+    The connections are keyed by (host, port, username). A borrower gets
+    the live connection of its key or the first borrower opens one, the
+    others wait for its handshake. The borrowers hold a slot of channel()
+    while a command, a shell, a scp or a SFTP transfer runs, at most
+    `max_channels` of them run on a host at the same time whatever the
+    number of borrowers (the parallel_files of a transfer included).
+
+    idle_timeout:  close a connection nobody used for this long (seconds).
+    max_age:       do not hand out a connection older than this, it is
+                   closed when its last borrower gives it back.
+    check_after:   run a cheap command before handing out a connection
+                   idle for this long, a dead one is replaced.
+
+    asyncssh binds a connection to its event loop, the pool must be used
+    from one long-lived loop.
+    """
+
+    def __init__(self,
+                 idle_timeout: float=60,
+                 max_age: float=600,
+                 max_channels: int=4,
+                 check_after: float=15,
+                 check_timeout: float=3):
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self.max_channels = max_channels
+        self.check_after = check_after
+        self.check_timeout = check_timeout
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._entries: Dict[Tuple[str, int, str], _PooledConnection] = {}
+        ## every handed out connection, also the retired ones still borrowed
+        self._owners: Dict[asyncssh.SSHClientConnection, Tuple[Tuple[str, int, str], _PooledConnection]] = {}
+        self._locks: Dict[Tuple[str, int, str], asyncio.Lock] = {}
+        self._channels: Dict[Tuple[str, int, str], asyncio.Semaphore] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        if self._loop is not None and not self._loop.is_closed():
+            raise RuntimeError("CYLSSHPool is bound to another running event loop.")
+        ## the old loop is gone and took its connections with it
+        self._entries.clear()
+        self._owners.clear()
+        self._locks.clear()
+        self._channels.clear()
+        self._loop = loop
+
+    def _drop(self, key, entry: _PooledConnection):
+        if self._entries.get(key) is entry:
+            del self._entries[key]
+        if entry.idle_handle:
+            entry.idle_handle.cancel()
+            entry.idle_handle = None
+        self._owners.pop(entry.conn, None)
+        entry.conn.close()
+
+    def _evict_idle(self, key, entry: _PooledConnection):
+        entry.idle_handle = None
+        if entry.users == 0:
+            _LOGGER.debug(f"host ({key[0]}) close the idle ssh connection.")
+            self._drop(key, entry)
+
+    async def _is_healthy(self, key, entry: _PooledConnection) -> bool:
+        if entry.conn.is_closed():
+            return False
+        if time.monotonic() - entry.created > self.max_age:
+            _LOGGER.debug(f"host ({key[0]}) ssh connection reached its max age.")
+            return False
+        if time.monotonic() - entry.last_used < self.check_after:
+            return True
+        try:
+            await entry.conn.run("true", timeout=self.check_timeout)
+        except Exception as e:
+            _LOGGER.warning(f"host ({key[0]}) health check Exception caught- {type(e).__name__}: {e}")
+            return False
+        return True
+
+    async def async_acquire(self,
+                            host: str,
+                            username: str,
+                            password: str,
+                            port: int=22,
+                            timeout: float=10) -> asyncssh.SSHClientConnection:
+        """Borrow the connection of (host, port, username), give it back by release()."""
+
+        self._bind_loop()
+        key = (host, port, username)
+        self._channels.setdefault(key, asyncio.Semaphore(self.max_channels))
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            entry = self._entries.get(key)
+            if entry and not await self._is_healthy(key, entry):
+                entry.retired = True
+                del self._entries[key]
+                if entry.users == 0:
+                    self._drop(key, entry)
+                entry = None
+
+            if entry is None:
+                conn = await asyncio.wait_for(asyncssh.connect(host=host,
+                                                               port=port,
+                                                               username=username,
+                                                               password=password,
+                                                               server_host_key_algs=['ssh-rsa'],
+                                                               known_hosts=None),
+                                              timeout=timeout)
+                entry = _PooledConnection(conn)
+                self._entries[key] = entry
+                self._owners[conn] = (key, entry)
+                _LOGGER.debug(f"host ({host}) new ssh connection, {len(self._entries)} pooled.")
+
+            if entry.idle_handle:
+                entry.idle_handle.cancel()
+                entry.idle_handle = None
+            entry.users += 1
+            entry.last_used = time.monotonic()
+            return entry.conn
+
+    @contextlib.asynccontextmanager
+    async def channel(self, conn: asyncssh.SSHClientConnection):
+        """Hold one of the max_channels channel slots of the host of the borrowed connection."""
+
+        owner = self._owners.get(conn)
+        if owner is None:
+            yield
+            return
+        async with self._channels[owner[0]]:
+            yield
+
+    def release(self, conn: asyncssh.SSHClientConnection, discard: bool=False):
+        """Give the borrowed connection back, discard=True closes it (e.g. it broke)."""
+
+        owner = self._owners.get(conn)
+        if owner is None:
+            conn.close()
+            return
+        key, entry = owner
+        entry.users = max(0, entry.users - 1)
+        entry.last_used = time.monotonic()
+
+        if discard:
+            entry.retired = True
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+        if entry.users:
+            return
+        if entry.retired or conn.is_closed():
+            self._drop(key, entry)
+        else:
+            entry.idle_handle = asyncio.get_running_loop().call_later(self.idle_timeout,
+                                                                      self._evict_idle, key, entry)
+
+    async def async_close(self):
+        """Close every pooled connection."""
+
+        conns = list(self._owners)
+        for key, entry in list(self._owners.values()):
+            self._drop(key, entry)
+        await asyncio.gather(*(conn.wait_closed() for conn in conns), return_exceptions=True)
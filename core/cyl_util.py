@@ -8,6 +8,7 @@ from typing import Any, Callable, Optional, Tuple, TypeVar, Union
 
 from .const import LOGGING_LEVEL
 from .cyl_logger import CYLLogger
+from .cyl_process import PROCESS_RUNNER
 from .cyl_wrapper import Retry
 
 _LOGGER = logging.getLogger(__name__)
@@ -338,22 +339,24 @@ def run_cmd(cmd, timeout=10):
 
 
 async def async_run_cmd(program, *args, timeout=10):
-    """Run subprocess and get response."""
+    """Run subprocess and get response.
 
-    proc = await asyncio.create_subprocess_exec(
-        program,
-        *args,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE)
-    try:
-        stdout, stderr = await proc.communicate()
-        await asyncio.wait_for(proc.wait(), timeout=timeout)
-
-        return True, stdout.decode('utf-8').strip()
-    except Exception as err:
-        # print(f"timed out")
-        proc.kill()
-    return False, 'Process timed out'
+    The timeout bounds the whole run, the process group is killed when
+    it expires and the output printed so far is returned with False.
+    """
+
+    return await PROCESS_RUNNER.async_run(program, *args, timeout=timeout)
+
+def file_md5(path, block_size: int=1 << 20) -> str:
+    """md5 hex digest of the file."""
+
+    import hashlib
+
+    m = hashlib.md5()
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            m.update(block)
+    return m.hexdigest()
 
 def source_hash(dir) -> str:
     """make source hash"""
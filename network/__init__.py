@@ -5,13 +5,13 @@ from ipaddress import IPv4Address, IPv6Address, ip_interface
 
 from .const import IPV4_BROADCAST_ADDR
 from .models import Adapter
-from .network import async_load_adapters
+from .network import ADAPTER_REGISTRY, AdapterRegistry, async_load_adapters
 
 _LOGGER = logging.getLogger(__name__)
 
 async def async_get_adapters() -> list[Adapter]:
-    """Get the network adapter configuration."""
-    return await async_load_adapters()
+    """Get the network adapter configuration, cached until it changes."""
+    return await ADAPTER_REGISTRY.async_get_adapters()
 
 
 async def async_get_enabled_source_ips() -> list[IPv4Address | IPv6Address]:
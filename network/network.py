@@ -1,7 +1,12 @@
 """Network helper class for the network integration."""
 from __future__ import annotations
 
+import asyncio
 import logging
+import socket
+import sys
+import threading
+import time
 from ipaddress import IPv4Address, IPv6Address, ip_address
 
 import ifaddr
@@ -11,8 +16,15 @@ from .models import Adapter, IPv4ConfiguredAddress, IPv6ConfiguredAddress
 
 _LOGGER = logging.getLogger(__name__)
 
-async def async_load_adapters() -> list[Adapter]:
-    """Load adapters."""
+## rtnetlink multicast groups of the link and address changes
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV6_IFADDR = 0x100
+
+
+def load_adapters() -> list[Adapter]:
+    """Load adapters, this blocks on the system calls of ifaddr."""
     source_ip_address = ip_address(MDNS_TARGET_IP)
 
     adapters: list[Adapter] = []
@@ -21,7 +33,112 @@ async def async_load_adapters() -> list[Adapter]:
         if _adapter_has_external_address(adapter):
             adapters.append(adapter)
 
-    return adapters     
+    return adapters
+
+
+async def async_load_adapters() -> list[Adapter]:
+    """Load adapters off the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, load_adapters)
+
+
+class AdapterRegistry:
+    """Cache the adapters until the interface configuration changes.
+
+    On linux the changes are told by a rtnetlink socket subscribed to the
+    link and address groups, which is drained without blocking on every
+    lookup. Elsewhere the cache is refreshed when the interface list
+    changes or after `ttl` seconds.
+    """
+
+    def __init__(self, ttl: float = 30) -> None:
+        self.ttl = ttl
+        self._adapters: list[Adapter] | None = None
+        self._fingerprint: tuple | None = None
+        self._loaded_at = 0.0
+        self._dirty = True
+        self._lock = threading.Lock()
+        self._netlink = self._open_netlink()
+
+    @staticmethod
+    def _open_netlink() -> socket.socket | None:
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+            sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR))
+            sock.setblocking(False)
+        except (OSError, AttributeError) as e:
+            _LOGGER.debug(f"netlink is not available: {e}")
+            return None
+        return sock
+
+    def _poll_netlink(self) -> None:
+        """Drain the pending netlink events, any of them marks the cache dirty."""
+        while True:
+            try:
+                data = self._netlink.recv(65536)
+            except BlockingIOError:
+                return
+            except OSError:
+                ## ENOBUFS: events were dropped, so reload anyway
+                self._dirty = True
+                return
+            if not data:
+                return
+            self._dirty = True
+
+    @staticmethod
+    def _get_fingerprint() -> tuple:
+        try:
+            return tuple(socket.if_nameindex())
+        except OSError:
+            return ()
+
+    def _is_stale(self) -> bool:
+        if self._adapters is None:
+            return True
+        if self._netlink is not None:
+            self._poll_netlink()
+            return self._dirty
+        if time.monotonic() - self._loaded_at > self.ttl:
+            return True
+        return self._get_fingerprint() != self._fingerprint
+
+    def invalidate(self) -> None:
+        """Force a reload on the next lookup."""
+        with self._lock:
+            self._adapters = None
+            self._dirty = True
+
+    def get_adapters(self) -> list[Adapter]:
+        """Get the cached adapters, reload them if the configuration changed."""
+        with self._lock:
+            if self._is_stale():
+                self._dirty = False
+                self._fingerprint = self._get_fingerprint()
+                self._adapters = load_adapters()
+                self._loaded_at = time.monotonic()
+                _LOGGER.debug(f"adapters reloaded: {[a['name'] for a in self._adapters]}")
+            return list(self._adapters)
+
+    async def async_get_adapters(self) -> list[Adapter]:
+        """Get the cached adapters without blocking the event loop."""
+        if self._netlink is not None and (adapters := self._adapters) is not None:
+            self._poll_netlink()
+            if not self._dirty:
+                return list(adapters)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get_adapters)
+
+    def close(self) -> None:
+        if self._netlink is not None:
+            self._netlink.close()
+            self._netlink = None
+
+
+ADAPTER_REGISTRY = AdapterRegistry()
+
 
 def _adapter_has_external_address(adapter: Adapter) -> bool:
     """Adapter has a non-loopback and non-link-local address."""
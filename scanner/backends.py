@@ -0,0 +1,312 @@
+"""Scan backends for the scanner."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import socket
+import struct
+import sys
+import time
+from abc import ABC, abstractmethod
+from ipaddress import IPv4Address, IPv4Network, IPv6Network, ip_interface, ip_network
+
+import network
+
+from .targets import AddressCursor
+
+_LOGGER = logging.getLogger(__name__)
+_LOGGER.setLevel(logging.DEBUG)
+
+ETH_P_ARP = 0x0806
+ETH_P_IP = 0x0800
+ARP_REQUEST = 1
+ARP_REPLY = 2
+BROADCAST_MAC = b"\xff" * 6
+
+_ETH_HEADER = struct.Struct("!6s6sH")
+_ARP_PACKET = struct.Struct("!HHBBH6s4s6s4s")
+
+
+class ScanBackend(ABC):
+    """The interface of a scan backend.
+
+    A backend discovers the hosts of one target network and returns
+    them as a list of {"mac", "ip"} records. `rate` is the packets per
+    second the scan may use, None means the backend default.
+    """
+
+    name: str = ""
+    ## every target block costs a process (or a session), not only its addresses
+    cost_per_block: bool = False
+
+    @classmethod
+    def is_available(cls) -> bool:
+        """Can this backend run on the current host ?"""
+        return True
+
+    @abstractmethod
+    async def async_scan(self, ip_net: IPv4Network | IPv4Address, timeout: float = 5,
+                         rate: float | None = None) -> list[dict]:
+        """Scan the network and return the hosts."""
+        return []
+
+    async def async_iter_scan(self, ip_net: IPv4Network | IPv4Address, timeout: float = 5,
+                              rate: float | None = None):
+        """Yield the hosts as soon as they are found."""
+        for host in await self.async_scan(ip_net, timeout=timeout, rate=rate):
+            yield host
+
+
+_BACKENDS: dict[str, type[ScanBackend]] = {}
+
+
+def register_backend(cls: type[ScanBackend]) -> type[ScanBackend]:
+    """Register a backend class by its name."""
+    _BACKENDS[cls.name] = cls
+    return cls
+
+
+def get_backend(backend: str | ScanBackend | None = None, **kwargs) -> ScanBackend:
+    """Get a backend instance by name.
+
+    "auto" prefers the AF_PACKET sweeper when it can run here and
+    falls back to arp-scan.
+    """
+    if isinstance(backend, ScanBackend):
+        return backend
+
+    name = backend or "auto"
+    if name == "auto":
+        name = "af-packet" if AfPacketArpBackend.is_available() else "arp-scan"
+
+    if name not in _BACKENDS:
+        raise ValueError(f"scan backend: '{name}' is not supported.")
+    return _BACKENDS[name](**kwargs)
+
+
+def backend_names() -> list[str]:
+    return list(_BACKENDS)
+
+
+## ==============================================
+## Fake backend
+## ==============================================
+
+@register_backend
+class FakeScanBackend(ScanBackend):
+    """Answer from a fixed host list, for testing without a LAN."""
+
+    name = "fake"
+
+    def __init__(self, hosts: list[dict] | None = None, delay: float = 0):
+        self.hosts = list(hosts or [])
+        self.delay = delay
+
+    async def async_scan(self, ip_net: IPv4Network | IPv4Address, timeout: float = 5,
+                         rate: float | None = None) -> list[dict]:
+        target = ip_network(str(ip_net), False)
+        if self.delay:
+            await asyncio.sleep(min(self.delay, timeout))
+        return [{"mac": host["mac"].upper(), "ip": host["ip"]}
+                for host in self.hosts
+                if IPv4Address(host["ip"]) in target]
+
+
+## ==============================================
+## Linux AF_PACKET ARP sweeper
+## ==============================================
+
+def make_arp_request(src_mac: bytes, src_ip: IPv4Address, target_ip: IPv4Address) -> bytes:
+    """Build an ethernet broadcast ARP request frame."""
+    eth = _ETH_HEADER.pack(BROADCAST_MAC, src_mac, ETH_P_ARP)
+    arp = _ARP_PACKET.pack(1, ETH_P_IP, 6, 4, ARP_REQUEST,
+                           src_mac, src_ip.packed,
+                           b"\x00" * 6, target_ip.packed)
+    return eth + arp
+
+
+def parse_arp_frame(frame: bytes) -> tuple[int, str, str] | None:
+    """Parse an ARP frame to (op, sender ip, sender mac)."""
+    size = _ETH_HEADER.size + _ARP_PACKET.size
+    if len(frame) < size:
+        return None
+
+    _, _, ethertype = _ETH_HEADER.unpack_from(frame)
+    if ethertype != ETH_P_ARP:
+        return None
+
+    (htype, ptype, hlen, plen, op,
+     sha, spa, _, _) = _ARP_PACKET.unpack_from(frame, _ETH_HEADER.size)
+    if htype != 1 or ptype != ETH_P_IP or hlen != 6 or plen != 4:
+        return None
+
+    mac = ":".join(f"{b:02X}" for b in sha)
+    return op, str(IPv4Address(spa)), mac
+
+
+def parse_arp_reply(frame: bytes) -> tuple[str, str] | None:
+    """Parse an ARP reply frame to (ip, mac)."""
+    arp = parse_arp_frame(frame)
+    if arp is None or arp[0] != ARP_REPLY:
+        return None
+    return arp[1], arp[2]
+
+
+def get_interface_mac(ifname: str) -> bytes | None:
+    """Read the hardware address of a linux interface."""
+    try:
+        with open(os.path.join("/sys/class/net", ifname, "address")) as f:
+            return bytes.fromhex(f.read().strip().replace(":", ""))
+    except (OSError, ValueError):
+        return None
+
+
+async def async_find_source(ip_net: IPv4Network, fallback: bool = True) -> tuple[str, IPv4Address] | None:
+    """Find the (interface, source ip) which owns the target network.
+
+    Without an owner the first IPv4 adapter is returned, or None if
+    `fallback` is False.
+    """
+    adapters = await network.async_get_adapters()
+    first = None
+    for adapter in adapters:
+        for ip_info in adapter["ipv4"]:
+            interface = ip_interface(f"{ip_info['address']}/{ip_info['network_prefix']}")
+            if interface.network.overlaps(ip_net):
+                return adapter["name"], interface.ip
+            if first is None:
+                first = (adapter["name"], interface.ip)
+    return first if fallback else None
+
+
+async def async_group_by_interface(networks: list[IPv4Network | IPv6Network]) -> dict[str | None, list]:
+    """Group the networks by the interface which owns them, None for the unowned ones."""
+    groups: dict[str | None, list] = {}
+    for net in networks:
+        source = await async_find_source(net, fallback=False) if net.version == 4 else None
+        groups.setdefault(source[0] if source else None, []).append(net)
+    return groups
+
+
+@register_backend
+class AfPacketArpBackend(ScanBackend):
+    """Sweep a network with ARP requests on one AF_PACKET socket.
+
+    The requests are sent at `rate` packets per second while the
+    replies are collected on the same socket, so no external process
+    or text parsing is involved.
+    """
+
+    name = "af-packet"
+    ## every sweep waits wait * (1 + retry) for the late replies, whatever its size
+    cost_per_block = True
+
+    def __init__(self, rate: float = 1000, wait: float = 1.0, retry: int = 1):
+        self.rate = rate
+        self.wait = wait
+        self.retry = retry
+
+    @classmethod
+    def is_available(cls) -> bool:
+        if not sys.platform.startswith("linux") or not hasattr(socket, "AF_PACKET"):
+            return False
+        try:
+            sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ARP))
+        except OSError:
+            return False
+        sock.close()
+        return True
+
+    async def async_scan(self, ip_net: IPv4Network | IPv4Address, timeout: float = 5,
+                         rate: float | None = None) -> list[dict]:
+        hosts = []
+        await self._async_run(ip_net, timeout, rate, hosts.append)
+        return hosts
+
+    async def async_iter_scan(self, ip_net: IPv4Network | IPv4Address, timeout: float = 5,
+                              rate: float | None = None):
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        async def run():
+            try:
+                await self._async_run(ip_net, timeout, rate, queue.put_nowait)
+            finally:
+                queue.put_nowait(done)
+
+        task = asyncio.create_task(run())
+        try:
+            while (host := await queue.get()) is not done:
+                yield host
+            await task
+        finally:
+            task.cancel()
+
+    async def _async_run(self, ip_net, timeout, rate, on_found):
+        target = ip_network(str(ip_net), False)
+        source = await async_find_source(target)
+        if source is None:
+            _LOGGER.error(f"{target}: no interface to send from")
+            return
+
+        ifname, src_ip = source
+        src_mac = get_interface_mac(ifname)
+        if src_mac is None:
+            _LOGGER.error(f"{target}: cannot get the MAC of ({ifname})")
+            return
+
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ARP))
+        try:
+            sock.bind((ifname, ETH_P_ARP))
+            sock.setblocking(False)
+            await self._async_sweep(sock, src_mac, src_ip, target, timeout, rate or self.rate, on_found)
+        finally:
+            sock.close()
+
+    async def _async_sweep(self, sock, src_mac, src_ip, target, timeout, rate, on_found):
+        loop = asyncio.get_running_loop()
+        found: dict[str, str] = {}
+        deadline = time.monotonic() + timeout
+        ## the addresses are made chunk by chunk, a /8 is never held in memory
+        cursor = AddressCursor([target], hosts_only=True)
+        wanted = len(cursor)
+
+        async def receive():
+            while True:
+                frame = await loop.sock_recv(sock, 2048)
+                reply = parse_arp_reply(frame)
+                if reply and reply[0] not in found and IPv4Address(reply[0]) in target:
+                    found[reply[0]] = reply[1]
+                    on_found({"mac": reply[1], "ip": reply[0]})
+
+        receiver = asyncio.create_task(receive())
+        try:
+            interval = 1 / rate if rate else 0
+            for _ in range(1 + self.retry):
+                start = time.monotonic()
+                sent = 0
+                cursor.offset = 0
+                for chunk in cursor:
+                    if time.monotonic() >= deadline:
+                        break
+                    for addr in chunk:
+                        if str(addr) in found:
+                            continue
+                        await loop.sock_sendall(sock, make_arp_request(src_mac, src_ip, addr))
+                        sent += 1
+                        ## pace to the packet rate
+                        if interval and (delay := start + sent * interval - time.monotonic()) > 0:
+                            await asyncio.sleep(delay)
+
+                wait = min(self.wait, deadline - time.monotonic())
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                if len(found) >= wanted or time.monotonic() >= deadline:
+                    break
+        finally:
+            receiver.cancel()
+            try:
+                await receiver
+            except (asyncio.CancelledError, OSError):
+                pass
@@ -0,0 +1,122 @@
+"""Benchmark the scanner against the fake arp-scan, no LAN needed.
+
+    python -m scanner.benchmark --network 10.0.0.0/20 --density 0.5 --rate 0
+
+It reports the parse rate of the arp-scan lines, the de-duplication
+cost, the end-to-end latency and the peak python memory of
+async_main_scanner and scan_devices.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+from ipaddress import IPv4Network
+
+from . import fake_arp_scan, scanner
+from .planner import HostIndex, ShardPlanner
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def use_fake_arp_scan(density: float, cyl: float, dup: float, bad: float, rate: float, seed: int):
+    """Substitute ARP_EXE with the fake emitter, return the original (ARP_EXE, OPTION)."""
+
+    original = (scanner.ARP_EXE, scanner.OPTION)
+    scanner.ARP_EXE = sys.executable
+    scanner.OPTION = "-m scanner.fake_arp_scan"
+
+    os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT_DIR, os.environ.get("PYTHONPATH")]))
+    os.environ.update({"FAKE_ARP_DENSITY": str(density),
+                       "FAKE_ARP_CYL": str(cyl),
+                       "FAKE_ARP_DUP": str(dup),
+                       "FAKE_ARP_BAD": str(bad),
+                       "FAKE_ARP_RATE": str(rate),
+                       "FAKE_ARP_SEED": str(seed)})
+    return original
+
+
+def measure(func, *args, **kwargs):
+    """Run func, return (result, seconds, peak traced bytes)."""
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+        spent = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, spent, peak
+
+
+def bench_parse(lines: list[str]) -> tuple[list[dict], float]:
+    """Parse the lines, return the hosts and the lines per second."""
+
+    start = time.perf_counter()
+    hosts = [host for line in lines if (host := scanner.parse_arp_scan_line(line))]
+    spent = time.perf_counter() - start
+    return hosts, len(lines) / spent if spent else float("inf")
+
+
+def bench_dedup(hosts: list[dict]) -> tuple[int, float]:
+    """Index the hosts, return the unique count and the microseconds per host."""
+
+    index = HostIndex()
+    start = time.perf_counter()
+    for host in hosts:
+        index.add(host)
+    spent = time.perf_counter() - start
+    return len(index), spent * 1e6 / max(1, len(hosts))
+
+
+def report(name: str, **values):
+    text = ", ".join(f"{key}: {value}" for key, value in values.items())
+    print(f"{name:<20} {text}")
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="scanner.benchmark",
+                                     description="Benchmark the scanner with a fake arp-scan.")
+    parser.add_argument("--network", help="The target network. Default to 10.0.0.0/20.", default="10.0.0.0/20")
+    parser.add_argument("--density", help="The share of answering addresses.", type=float, default=0.5)
+    parser.add_argument("--cyl", help="The share of CYL MACs.", type=float, default=0.5)
+    parser.add_argument("--dup", help="The share of DUP lines.", type=float, default=0.05)
+    parser.add_argument("--bad", help="The share of malformed lines.", type=float, default=0.02)
+    parser.add_argument("--rate", help="The fake lines per second, 0 for no pacing.", type=float, default=0)
+    parser.add_argument("--seed", help="The random seed.", type=int, default=0)
+    parser.add_argument("--timeout", help="The sync scan timeout in seconds.", type=float, default=30)
+    args = parser.parse_args(argv)
+
+    target = IPv4Network(args.network, False)
+    original = use_fake_arp_scan(args.density, args.cyl, args.dup, args.bad, args.rate, args.seed)
+    try:
+        ## the hot parse loop, in process
+        lines = [line for shard in ShardPlanner().plan([target])
+                 for line in fake_arp_scan.make_arp_scan_lines(shard, args.density, args.cyl,
+                                                               args.dup, args.bad, args.seed)]
+        (hosts, parse_rate), spent, peak = measure(bench_parse, lines)
+        report("parse", lines=len(lines), hosts=len(hosts),
+               rate=f"{parse_rate:,.0f} lines/s", peak=f"{peak / 1024:,.0f} KiB")
+
+        (unique, cost), spent, peak = measure(bench_dedup, hosts)
+        report("dedup", hosts=len(hosts), unique=unique,
+               cost=f"{cost:.2f} us/host", peak=f"{peak / 1024:,.0f} KiB")
+
+        ## end to end, through the fake process
+        found, spent, peak = measure(asyncio.run, scanner.async_main_scanner(str(target), backend="arp-scan"))
+        report("async_main_scanner", hosts=len(found),
+               latency=f"{spent:.3f} s", peak=f"{peak / 1024:,.0f} KiB")
+
+        found, spent, peak = measure(scanner.scan_devices, str(target), timeout=args.timeout)
+        report("scan_devices", hosts=len(found),
+               latency=f"{spent:.3f} s", peak=f"{peak / 1024:,.0f} KiB")
+    finally:
+        scanner.ARP_EXE, scanner.OPTION = original
+
+
+if __name__ == '__main__':
+    main()
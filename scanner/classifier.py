@@ -0,0 +1,83 @@
+"""MAC prefix classifier for the scanner."""
+from __future__ import annotations
+
+import logging
+import os
+
+from core import cyl_util
+
+_LOGGER = logging.getLogger(__name__)
+_LOGGER.setLevel(logging.DEBUG)
+
+DEFAULT_MAC_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mac_families.json")
+
+
+def mac_nibbles(mac: str) -> str:
+    """Strip the separators of a MAC (prefix): 'D0:14:11:B' -> 'D01411B'."""
+    return mac.replace(":", "").replace("-", "").replace(".", "").upper()
+
+
+class MACClassifier(object):
+    """A nibble trie of MAC prefixes.
+
+    Every prefix carries a tag dict such as {"family": ..., "model": ...}.
+    classify() walks the trie once per MAC, so its cost only depends on the
+    prefix length whatever the number of prefixes.
+    """
+
+    def __init__(self, table: list[dict] | None = None):
+        self._root: dict = {}
+        self._size = 0
+        for entry in table or []:
+            entry = dict(entry)
+            self.add(entry.pop("prefix"), entry)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, prefix: str, tags: dict):
+        """Add a MAC prefix, a longer prefix wins over a shorter one."""
+        node = self._root
+        for nibble in mac_nibbles(prefix):
+            node = node.setdefault(nibble, {})
+        if None not in node:
+            self._size += 1
+        node[None] = tags
+
+    def classify(self, mac: str) -> dict | None:
+        """Return the tags of the longest matched prefix, None if no prefix matches."""
+        node = self._root
+        tags = node.get(None)
+        for nibble in mac_nibbles(mac):
+            node = node.get(nibble)
+            if node is None:
+                break
+            tags = node.get(None, tags)
+        return tags
+
+    def tag_hosts(self, hosts):
+        """Filter and tag the hosts in one pass."""
+        for host in hosts:
+            if (tags := self.classify(host["mac"])) is not None:
+                yield {**host, **tags}
+
+
+def load_mac_classifier(json_path: str = DEFAULT_MAC_TABLE) -> MACClassifier | None:
+    """Load the classifier from a {"families": [{"prefix": ..., ...}]} json."""
+    if not (config := cyl_util.load_config_json(json_path)):
+        return None
+
+    classifier = MACClassifier(config.get("families", []))
+    _LOGGER.debug(f"load {len(classifier)} MAC prefixes from {json_path}")
+    return classifier
+
+
+_default_classifier: MACClassifier | None = None
+
+
+def get_default_classifier() -> MACClassifier | None:
+    """The classifier of mac_families.json, loaded once, None if the table cannot be read."""
+    global _default_classifier
+    if _default_classifier is None:
+        _default_classifier = load_mac_classifier() or MACClassifier()
+    return _default_classifier if len(_default_classifier) else None
@@ -0,0 +1,254 @@
+"""Merge the hosts of several discovery sources into one MAC-keyed view."""
+from __future__ import annotations
+
+import asyncio
+import copy
+import logging
+import time
+from ipaddress import ip_address
+
+from core.cyl_inventory import CYLInventory
+
+from .backends import get_backend
+from .classifier import MACClassifier
+from .planner import ShardPlanner
+from .scanner import async_get_target_networks, async_iter_scanner, filter_hosts
+
+_LOGGER = logging.getLogger(__name__)
+_LOGGER.setLevel(logging.DEBUG)
+
+INVENTORY_SOURCE = "inventory"
+
+## how much a sighting by the source is trusted, the active probes rank first
+SOURCE_CONFIDENCE = {
+    "arp-scan": 0.95,
+    "af-packet": 0.95,
+    "mdns": 0.9,
+    "ipv6-ll": 0.9,
+    "neighbors": 0.6,
+    INVENTORY_SOURCE: 0.3,
+}
+DEFAULT_CONFIDENCE = 0.5
+
+NEW = "new"
+MOVED = "moved"
+SEEN = "seen"
+
+
+def _is_ipv6(ip: str) -> bool:
+    return ":" in ip
+
+
+class DiscoveryIndex(object):
+    """Host records keyed by MAC with the sources which saw them.
+
+    A record is {"mac", "ip", "ipv6", "sources": {source: seen}, "confidence",
+    "first_seen", "last_seen", "old_ips"} plus the extra fields of the
+    host (e.g. the classifier tags). The IPv4 and IPv6 link-local addresses
+    of a MAC are kept apart. When two sources tell different IPs for a
+    MAC, the more trusted source wins and among equals the latest one.
+    """
+
+    def __init__(self, confidence: dict[str, float] | None = None):
+        self.confidence = dict(SOURCE_CONFIDENCE, **(confidence or {}))
+        self._records: dict[str, dict] = {}
+        self._ip_macs: dict[str, set[str]] = {}
+        ## the source confidence which set the current ip of a MAC
+        self._ip_rank: dict[str, float] = {}
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, mac: str):
+        return mac.upper() in self._records
+
+    def get(self, mac: str) -> dict | None:
+        return self._records.get(mac.upper())
+
+    def _source_confidence(self, source: str) -> float:
+        return self.confidence.get(source, DEFAULT_CONFIDENCE)
+
+    def _claim_ip(self, ip: str, mac: str):
+        macs = self._ip_macs.setdefault(ip, set())
+        macs.add(mac)
+        if len(macs) == 2:
+            _LOGGER.warning(f"ip ({ip}) is claimed by multiple MACs: {sorted(macs)}")
+
+    def _release_ip(self, ip: str, mac: str):
+        if ip in self._ip_macs:
+            self._ip_macs[ip].discard(mac)
+
+    def update(self, host: dict, source: str, seen: float | None = None) -> str:
+        """Merge a sighting of the host by the source, return NEW, MOVED or SEEN."""
+        seen = time.time() if seen is None else seen
+        mac = host["mac"].upper()
+        ip = host.get("ip") or ""
+        rank = self._source_confidence(source)
+
+        record = self._records.get(mac)
+        if record is None:
+            record = {**host, "mac": mac, "ip": "", "ipv6": "", "sources": {},
+                      "confidence": 0.0, "first_seen": seen, "last_seen": seen, "old_ips": []}
+            self._records[mac] = record
+            state = NEW
+        else:
+            state = SEEN
+            record.update({k: v for k, v in host.items() if k not in ("mac", "ip")})
+
+        record["sources"][source] = max(seen, record["sources"].get(source, 0))
+        record["last_seen"] = max(seen, record["last_seen"])
+        ## the chance that at least one of the sources is right
+        miss = 1.0
+        for name in record["sources"]:
+            miss *= 1 - self._source_confidence(name)
+        record["confidence"] = round(1 - miss, 3)
+
+        if not ip:
+            return state
+        if _is_ipv6(ip):
+            record["ipv6"] = ip
+            if not record["ip"]:
+                record["ip"] = ip
+                self._claim_ip(ip, mac)
+            return state
+
+        current = record["ip"]
+        if current == ip:
+            self._ip_rank[mac] = max(rank, self._ip_rank.get(mac, 0))
+            return state
+        if current and not _is_ipv6(current) and rank < self._ip_rank.get(mac, 0):
+            _LOGGER.debug(f"{mac}: keep ({current}), ({ip}) of {source} is less trusted")
+            return state
+
+        if current:
+            self._release_ip(current, mac)
+            if not _is_ipv6(current):
+                record["old_ips"].append(current)
+                state = MOVED if state == SEEN else state
+        record["ip"] = ip
+        self._ip_rank[mac] = rank
+        self._claim_ip(ip, mac)
+        return state
+
+    def records(self) -> list[dict]:
+        return list(self._records.values())
+
+    def conflicts(self) -> dict[str, list[str]]:
+        """The IPs claimed by several MACs at the moment."""
+        return {ip: sorted(macs) for ip, macs in self._ip_macs.items() if len(macs) > 1}
+
+
+def _in_networks(ip: str, networks) -> bool:
+    try:
+        address = ip_address(ip.split("%")[0])
+    except ValueError:
+        return False
+    return any(address in net for net in networks if net.version == address.version)
+
+
+async def async_iter_discovery(ip_net_str: str = "",
+                               sources: tuple[str, ...] = ("auto", "neighbors"),
+                               mac_pattern: str | None = None,
+                               classifier: MACClassifier | None = None,
+                               planner: ShardPlanner | None = None,
+                               inventory: CYLInventory | None = None,
+                               expected_macs: set[str] | None = None,
+                               stop_when_confirmed: bool = False,
+                               index: DiscoveryIndex | None = None):
+    """Run the sources concurrently and yield (state, source, record) for every sighting.
+
+    sources:             the scan backend names, "inventory" adds the known
+                         devices of the inventory inside the targets.
+    expected_macs:       the MACs to confirm, the inventory MACs inside the
+                         targets by default.
+    stop_when_confirmed: stop once every expected MAC is seen by a source
+                         other than the inventory.
+    """
+
+    index = index if index is not None else DiscoveryIndex()
+    networks = await async_get_target_networks(ip_net_str)
+    sources = tuple(sources)
+
+    known = []
+    if inventory is not None:
+        known = [device for batch in inventory.iter_devices() for device in batch
+                 if device["ip"] and _in_networks(device["ip"], networks)]
+        known = list(filter_hosts(known, mac_pattern, classifier))
+    if expected_macs is None:
+        expected_macs = {device["mac"] for device in known}
+    pending = {mac.upper() for mac in expected_macs}
+
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    async def run(source):
+        try:
+            ## "auto" is labelled by the backend it resolves to
+            backend = get_backend(source)
+            if not backend.is_available():
+                _LOGGER.warning(f"{source} cannot run on this host, skipped.")
+                return
+            async for host in async_iter_scanner(ip_net_str, mac_pattern, backend=backend,
+                                                 planner=planner, classifier=classifier):
+                queue.put_nowait((backend.name, host))
+        except Exception as e:
+            _LOGGER.error(f"{source} Exception caught- {type(e).__name__}: {e}")
+        finally:
+            queue.put_nowait(done)
+
+    tasks = [asyncio.create_task(run(source)) for source in sources if source != INVENTORY_SOURCE]
+    if INVENTORY_SOURCE in sources:
+        for device in known:
+            host = {"mac": device["mac"], "ip": device["ip"]}
+            state = index.update(host, INVENTORY_SOURCE, device["last_seen"])
+            yield state, INVENTORY_SOURCE, index.get(host["mac"])
+
+    running = len(tasks)
+    try:
+        while running:
+            item = await queue.get()
+            if item is done:
+                running -= 1
+                continue
+
+            source, host = item
+            state = index.update(host, source)
+            yield state, source, index.get(host["mac"])
+
+            pending.discard(host["mac"].upper())
+            if stop_when_confirmed and expected_macs and not pending:
+                _LOGGER.debug(f"all {len(expected_macs)} expected MACs confirmed")
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    if conflicts := index.conflicts():
+        _LOGGER.warning(f"IPs with multiple MACs: {conflicts}")
+
+
+async def async_iter_hosts(ip_net_str: str = "", min_confidence: float = 0.9, **kwargs):
+    """Yield a copy of a record once its confidence reaches min_confidence, again when its MAC moves.
+
+    With the default, a MAC is only yielded after an active source saw
+    it, the neighbor table and the inventory alone are not trusted. A
+    moved MAC is yielded again with its new ip, the consumer re-probes it.
+    """
+    yielded: dict[str, str] = {}
+    async for state, _, record in async_iter_discovery(ip_net_str, **kwargs):
+        mac = record["mac"]
+        if record["confidence"] < min_confidence:
+            continue
+        if mac not in yielded or (state == MOVED and yielded[mac] != record["ip"]):
+            yielded[mac] = record["ip"]
+            yield copy.deepcopy(record)
+
+
+async def async_discover(ip_net_str: str = "", **kwargs) -> list[dict]:
+    """Run the discovery to the end and return the merged records."""
+    index = kwargs.pop("index", None)
+    index = index if index is not None else DiscoveryIndex()
+    async for _ in async_iter_discovery(ip_net_str, index=index, **kwargs):
+        pass
+    return index.records()
@@ -0,0 +1,100 @@
+"""A fake arp-scan which prints realistic output without a LAN.
+
+Run it as `python -m scanner.fake_arp_scan [arp-scan options] <target>`,
+the options are accepted and ignored. The output is tuned by the
+environment:
+
+    FAKE_ARP_DENSITY:  the share of the target addresses which answer (0.5)
+    FAKE_ARP_CYL:      the share of the answering hosts with a CYL MAC (0.5)
+    FAKE_ARP_DUP:      the share of the answers printed again as DUP (0.05)
+    FAKE_ARP_BAD:      the share of malformed lines (0.02)
+    FAKE_ARP_RATE:     the printed lines per second, 0 means no pacing (0)
+    FAKE_ARP_SEED:     the random seed, the same target prints the same hosts (0)
+"""
+from __future__ import annotations
+
+import os
+import random
+import sys
+import time
+from ipaddress import IPv4Address, IPv4Network
+
+CYL_PREFIX = "d0:14:11:b"
+OTHER_VENDORS = [("00:1a:2b", "Ayecom Technology Co., Ltd."),
+                 ("3c:22:fb", "Apple, Inc."),
+                 ("b8:27:eb", "Raspberry Pi Foundation"),
+                 ("f4:f2:6d", "TP-LINK TECHNOLOGIES CO.,LTD.")]
+
+MALFORMED_LINES = ["WARNING: Cannot open MAC/Vendor file ieee-oui.txt: Permission denied",
+                   "10.0.0\td0:14:11:b",
+                   "\t(Unknown)",
+                   "999.1.2.3\t00:11:22:33:44:55\tbogus"]
+
+
+def make_arp_scan_lines(target: IPv4Network,
+                        density: float = 0.5,
+                        cyl: float = 0.5,
+                        dup: float = 0.05,
+                        bad: float = 0.02,
+                        seed: int = 0):
+    """Yield the arp-scan lines of the target, header and footer included."""
+
+    rng = random.Random(f"{seed}-{target}")
+    addresses = [target.network_address] if target.num_addresses == 1 else target.hosts()
+
+    yield "Interface: eth0, type: EN10MB, MAC: 02:42:ac:11:00:02, IPv4: 10.0.0.2"
+    yield f"Starting arp-scan 1.10.0 with {target.num_addresses} hosts (https://github.com/royhills/arp-scan)"
+
+    responded = 0
+    for addr in addresses:
+        if rng.random() >= density:
+            continue
+        if rng.random() < bad:
+            yield rng.choice(MALFORMED_LINES)
+
+        suffix = int(addr) & 0xFFFFF
+        if rng.random() < cyl:
+            mac = f"{CYL_PREFIX}{suffix >> 16:x}:{(suffix >> 8) & 0xFF:02x}:{suffix & 0xFF:02x}"
+            vendor = "CHIYU Technology Inc."
+        else:
+            prefix, vendor = rng.choice(OTHER_VENDORS)
+            mac = f"{prefix}:{(suffix >> 16) & 0xFF:02x}:{(suffix >> 8) & 0xFF:02x}:{suffix & 0xFF:02x}"
+
+        responded += 1
+        yield f"{IPv4Address(addr)}\t{mac}\t{vendor}"
+        if rng.random() < dup:
+            yield f"{IPv4Address(addr)}\t{mac}\t{vendor} (DUP: 2)"
+
+    yield ""
+    yield f"{target.num_addresses} packets received by filter, 0 packets dropped by kernel"
+    yield f"Ending arp-scan 1.10.0: {target.num_addresses} hosts scanned in 1.234 seconds ({responded} responded)"
+
+
+def main(argv: list[str]) -> int:
+    targets = [arg for arg in argv if not arg.startswith("-")]
+    if not targets:
+        print("usage: fake_arp_scan [options] <target>", file=sys.stderr)
+        return 1
+
+    target = IPv4Network(targets[-1], False)
+    rate = float(os.environ.get("FAKE_ARP_RATE", 0))
+    lines = make_arp_scan_lines(target,
+                                density=float(os.environ.get("FAKE_ARP_DENSITY", 0.5)),
+                                cyl=float(os.environ.get("FAKE_ARP_CYL", 0.5)),
+                                dup=float(os.environ.get("FAKE_ARP_DUP", 0.05)),
+                                bad=float(os.environ.get("FAKE_ARP_BAD", 0.02)),
+                                seed=int(os.environ.get("FAKE_ARP_SEED", 0)))
+
+    start = time.monotonic()
+    for i, line in enumerate(lines):
+        ## pace to the line rate
+        if rate and (delay := start + i / rate - time.monotonic()) > 0:
+            sys.stdout.flush()
+            time.sleep(delay)
+        sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,69 @@
+"""Incremental rescan helpers for the scanner."""
+from __future__ import annotations
+
+import asyncio
+import logging
+from ipaddress import IPv4Address, IPv4Network, IPv6Network
+
+_LOGGER = logging.getLogger(__name__)
+_LOGGER.setLevel(logging.DEBUG)
+
+ADDED = "added"
+REMOVED = "removed"
+MOVED = "moved"
+UNCHANGED = "unchanged"
+
+
+class IncrementalScan(object):
+    """Compare the fresh hosts of a scan with the last known (mac -> ip) set.
+
+    update() sorts every fresh host, the added/moved/removed change events
+    are collected in `events` as {"event", "mac", "ip", "old_ip"} dicts.
+    """
+
+    def __init__(self, known: dict[str, str]):
+        self.known = {mac.upper(): ip for mac, ip in known.items()}
+        self.seen: dict[str, str] = {}
+        self.events: list[dict] = []
+
+    def update(self, host: dict) -> str:
+        mac = host["mac"].upper()
+        self.seen[mac] = host["ip"]
+
+        old_ip = self.known.get(mac)
+        if old_ip is None:
+            state = ADDED
+        elif old_ip != host["ip"]:
+            state = MOVED
+        else:
+            return UNCHANGED
+
+        self.events.append({"event": state, "mac": mac, "ip": host["ip"], "old_ip": old_ip})
+        return state
+
+    def finish(self, networks: list[IPv4Network | IPv6Network]) -> list[dict]:
+        """Add the removed events of the known hosts inside the scanned networks."""
+        for mac, ip in self.known.items():
+            if mac in self.seen or not ip:
+                continue
+            try:
+                address = IPv4Address(ip)
+            except ValueError:
+                continue
+            if any(address in net for net in networks if net.version == 4):
+                self.events.append({"event": REMOVED, "mac": mac, "ip": None, "old_ip": ip})
+        return self.events
+
+
+async def async_check_host(ip: str, port: int = 22, timeout: float = 1) -> bool:
+    """A cheap check of a known host: can its port be connected ?"""
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout=timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return True
@@ -0,0 +1,174 @@
+"""IPv6 link-local discovery for the scanner."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import socket
+import struct
+import sys
+from ipaddress import IPv4Address, IPv4Network, IPv6Address, IPv6Network, ip_network
+
+import network
+from core import cyl_util
+
+from . import passive
+from .backends import ScanBackend, async_find_source, register_backend
+
+_LOGGER = logging.getLogger(__name__)
+_LOGGER.setLevel(logging.DEBUG)
+
+ALL_NODES = "ff02::1"
+LINK_LOCAL_NET = IPv6Network("fe80::/10")
+
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+
+_ICMPV6_ECHO = struct.Struct("!BBHHH")
+
+
+def make_echo_request(ident: int, seq: int = 1) -> bytes:
+    """Build an ICMPv6 echo request, the kernel fills the checksum."""
+    return _ICMPV6_ECHO.pack(ICMPV6_ECHO_REQUEST, 0, 0, ident & 0xFFFF, seq) + b"SCPro"
+
+
+def is_echo_reply(packet: bytes) -> bool:
+    return len(packet) >= _ICMPV6_ECHO.size and packet[0] == ICMPV6_ECHO_REPLY
+
+
+def eui64_to_MAC(ipv6: str) -> str | None:
+    """The MAC of an EUI-64 interface id, None if the address is not EUI-64."""
+    address = IPv6Address(ipv6.split("%")[0])
+    if address.packed[11:13] != b"\xff\xfe":
+        return None
+    return cyl_util.ipv6_to_MAC(address.exploded)
+
+
+def open_icmpv6_socket(ifindex: int) -> socket.socket:
+    """Open an ICMPv6 socket sending to the multicast of one interface.
+
+    The unprivileged ping socket is tried first, then the raw socket.
+    """
+    try:
+        sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM, socket.IPPROTO_ICMPV6)
+    except OSError:
+        sock = socket.socket(socket.AF_INET6, socket.SOCK_RAW, socket.IPPROTO_ICMPV6)
+
+    try:
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_IF, ifindex)
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_HOPS, 1)
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_LOOP, 0)
+        sock.setblocking(False)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+async def async_get_link_local_interfaces() -> list[tuple[str, int]]:
+    """The (name, index) of the interfaces holding a link-local address."""
+    interfaces = []
+    for adapter in await network.async_get_adapters():
+        if any(IPv6Address(ipv6["address"]) in LINK_LOCAL_NET for ipv6 in adapter["ipv6"]):
+            interfaces.append((adapter["name"], adapter["index"]))
+    return interfaces
+
+
+async def async_ping_all_nodes(ifname: str, ifindex: int, timeout: float = 2) -> list[str]:
+    """Echo ff02::1 on the interface, return the link-local repliers as 'fe80::..%iface'."""
+    loop = asyncio.get_running_loop()
+    repliers: list[str] = []
+
+    sock = open_icmpv6_socket(ifindex)
+    try:
+        await loop.sock_sendto(sock, make_echo_request(os.getpid()), (ALL_NODES, 0, 0, ifindex))
+        deadline = loop.time() + timeout
+        while (remaining := deadline - loop.time()) > 0:
+            try:
+                packet, address = await asyncio.wait_for(loop.sock_recvfrom(sock, 1024), remaining)
+            except asyncio.TimeoutError:
+                break
+            ip = address[0].split("%")[0]
+            if not is_echo_reply(packet) or IPv6Address(ip) not in LINK_LOCAL_NET:
+                continue
+            if (host := f"{ip}%{ifname}") not in repliers:
+                repliers.append(host)
+    finally:
+        sock.close()
+    return repliers
+
+
+async def async_scan_link_local(interfaces: list[tuple[str, int]] | None = None,
+                                timeout: float = 2) -> list[dict]:
+    """Discover the link-local hosts of the interfaces in one round trip each.
+
+    The MACs come from the IPv6 neighbor table, or from the EUI-64
+    interface id when the table has no entry.
+    """
+    if interfaces is None:
+        interfaces = await async_get_link_local_interfaces()
+
+    async def ping(ifname, ifindex):
+        try:
+            return await async_ping_all_nodes(ifname, ifindex, timeout)
+        except OSError as e:
+            _LOGGER.error(f"{ALL_NODES}%{ifname} Exception caught- {type(e).__name__}: {e}")
+            return []
+
+    results = await asyncio.gather(*(ping(*interface) for interface in interfaces))
+    repliers = [ip for ips in results for ip in ips]
+    if not repliers:
+        return []
+
+    loop = asyncio.get_running_loop()
+    neighbors = await loop.run_in_executor(None, passive.dump_neighbors, socket.AF_INET6)
+    neighbor_macs = {host["ip"]: host["mac"] for host in neighbors}
+
+    hosts = []
+    for ip in repliers:
+        mac = neighbor_macs.get(ip) or eui64_to_MAC(ip)
+        if mac is None:
+            _LOGGER.debug(f"{ip}: no MAC in the neighbor table and not EUI-64")
+            continue
+        hosts.append({"mac": mac, "ip": ip})
+    return hosts
+
+
+@register_backend
+class LinkLocalBackend(ScanBackend):
+    """Find the IPv6 link-local hosts with one echo to ff02::1 per interface.
+
+    An IPv4 target selects the interface which owns it, an IPv6
+    link-local target selects all the interfaces. Every interface is
+    swept once per backend instance, the later shards reuse the result.
+    """
+
+    name = "ipv6-ll"
+
+    def __init__(self):
+        self._sweeps: dict[str, asyncio.Task] = {}
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return socket.has_ipv6 and sys.platform != "win32"
+
+    async def _async_interfaces(self, ip_net) -> list[tuple[str, int]]:
+        interfaces = await async_get_link_local_interfaces()
+        target = ip_network(str(ip_net), False)
+        if target.version == 6:
+            return interfaces
+
+        source = await async_find_source(target)
+        return [interface for interface in interfaces if source and interface[0] == source[0]]
+
+    async def async_scan(self, ip_net: IPv4Network | IPv4Address | IPv6Network, timeout: float = 5,
+                         rate: float | None = None) -> list[dict]:
+        sweeps = []
+        for ifname, ifindex in await self._async_interfaces(ip_net):
+            if ifname not in self._sweeps:
+                self._sweeps[ifname] = asyncio.ensure_future(
+                    async_scan_link_local([(ifname, ifindex)], timeout=min(timeout, 2)))
+            sweeps.append(self._sweeps[ifname])
+
+        results = await asyncio.gather(*(asyncio.shield(sweep) for sweep in sweeps))
+        return [host for hosts in results for host in hosts]
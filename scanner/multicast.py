@@ -0,0 +1,167 @@
+"""mDNS / UDP broadcast discovery for the scanner."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import socket
+import struct
+import sys
+from ipaddress import IPv4Address, IPv4Network, ip_interface, ip_network
+
+import network
+from network.const import MDNS_TARGET_IP
+
+from . import passive
+from .backends import ScanBackend, register_backend
+
+_LOGGER = logging.getLogger(__name__)
+_LOGGER.setLevel(logging.DEBUG)
+
+MDNS_PORT = 5353
+DNS_TYPE_PTR = 12
+DNS_CLASS_IN_QU = 0x8001  # IN with the unicast-response bit
+DISCARD_PORT = 9
+
+_DNS_HEADER = struct.Struct("!HHHHHH")
+
+
+def make_mdns_query(name: str = "_services._dns-sd._udp.local") -> bytes:
+    """Build a one question mDNS PTR query asking for unicast responses."""
+    qname = b"".join(bytes([len(label)]) + label.encode() for label in name.split(".")) + b"\x00"
+    return _DNS_HEADER.pack(0, 0, 1, 0, 0, 0) + qname + struct.pack("!HH", DNS_TYPE_PTR, DNS_CLASS_IN_QU)
+
+
+async def async_get_ipv4_interfaces() -> list[tuple[str, IPv4Address, IPv4Network]]:
+    """The (adapter name, address, network) of every IPv4 address."""
+    interfaces = []
+    for adapter in await network.async_get_adapters():
+        for ip_info in adapter["ipv4"]:
+            interface = ip_interface(f"{ip_info['address']}/{ip_info['network_prefix']}")
+            interfaces.append((adapter["name"], interface.ip, interface.network))
+    return interfaces
+
+
+def _open_query_socket(src_ip: IPv4Address) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, src_ip.packed)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 0)
+        sock.bind((str(src_ip), 0))
+        sock.setblocking(False)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+async def async_query_interface(src_ip: IPv4Address, net: IPv4Network, window: float = 1.5,
+                                broadcast: tuple[int, bytes] | None = None) -> set[str]:
+    """Send the mDNS query (and the broadcast probe) from src_ip, return the responder IPs.
+
+    broadcast: a (port, payload) probe sent to the broadcast address of the network.
+    """
+    loop = asyncio.get_running_loop()
+    responders: set[str] = set()
+
+    sock = _open_query_socket(src_ip)
+    try:
+        await loop.sock_sendto(sock, make_mdns_query(), (MDNS_TARGET_IP, MDNS_PORT))
+        if broadcast is not None:
+            port, payload = broadcast
+            await loop.sock_sendto(sock, payload, (str(net.broadcast_address), port))
+
+        deadline = loop.time() + window
+        while (remaining := deadline - loop.time()) > 0:
+            try:
+                _, address = await asyncio.wait_for(loop.sock_recvfrom(sock, 9000), remaining)
+            except asyncio.TimeoutError:
+                break
+            if address[0] != str(src_ip):
+                responders.add(address[0])
+    finally:
+        sock.close()
+    return responders
+
+
+async def async_resolve_MACs(ips: set[str], wait: float = 0.3) -> dict[str, str]:
+    """Map the IPs to MACs by the neighbor table.
+
+    Receiving a response does not teach the kernel the MAC of its
+    sender, so one datagram is sent to every unknown IP to make the
+    kernel resolve it. The neighbor table is only read on linux.
+    """
+    loop = asyncio.get_running_loop()
+    macs = {host["ip"]: host["mac"] for host in await loop.run_in_executor(None, passive.dump_neighbors)}
+    unknown = ips - macs.keys()
+    if unknown:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            for ip in unknown:
+                try:
+                    sock.sendto(b"", (ip, DISCARD_PORT))
+                except OSError:
+                    pass
+        await asyncio.sleep(wait)
+        macs.update({host["ip"]: host["mac"] for host in await loop.run_in_executor(None, passive.dump_neighbors)})
+    return {ip: macs[ip] for ip in ips if ip in macs}
+
+
+async def async_discover_multicast(window: float = 1.5, broadcast: tuple[int, bytes] | None = None,
+                                   target: IPv4Network | None = None) -> list[dict]:
+    """Query every interface overlapping the target at once and collect the responders."""
+    interfaces = [(name, src_ip, net) for name, src_ip, net in await async_get_ipv4_interfaces()
+                  if target is None or net.overlaps(target)]
+
+    async def query(name, src_ip, net):
+        try:
+            return await async_query_interface(src_ip, net, window, broadcast)
+        except OSError as e:
+            _LOGGER.error(f"{MDNS_TARGET_IP} on ({name}) Exception caught- {type(e).__name__}: {e}")
+            return set()
+
+    results = await asyncio.gather(*(query(*interface) for interface in interfaces))
+    ips = {ip for responders in results for ip in responders
+           if target is None or IPv4Address(ip) in target}
+    macs = await async_resolve_MACs(ips)
+    for ip in ips - macs.keys():
+        _LOGGER.debug(f"{ip}: responded but its MAC is unknown")
+    return [{"mac": mac, "ip": ip} for ip, mac in macs.items()]
+
+
+@register_backend
+class MulticastBackend(ScanBackend):
+    """Find the hosts answering an mDNS query, and optionally a UDP broadcast probe.
+
+    One query goes out per interface owning the target, the responses
+    are collected for `window` seconds. The interfaces are queried once
+    per backend instance, the later shards reuse the result. The MACs
+    come from the neighbor table, so it only runs on linux.
+    """
+
+    name = "mdns"
+
+    def __init__(self, window: float = 1.5, broadcast: tuple[int, bytes] | None = None):
+        self.window = window
+        self.broadcast = broadcast
+        self._queries: dict[str, asyncio.Future] = {}
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return sys.platform.startswith("linux")
+
+    async def async_scan(self, ip_net: IPv4Network | IPv4Address, timeout: float = 5,
+                         rate: float | None = None) -> list[dict]:
+        target = ip_network(str(ip_net), False)
+        queries = []
+        for _, _, net in await async_get_ipv4_interfaces():
+            if not net.overlaps(target):
+                continue
+            if str(net) not in self._queries:
+                self._queries[str(net)] = asyncio.ensure_future(
+                    async_discover_multicast(min(self.window, timeout), self.broadcast, net))
+            queries.append(self._queries[str(net)])
+
+        results = await asyncio.gather(*(asyncio.shield(query) for query in queries))
+        return [host for hosts in results for host in hosts if IPv4Address(host["ip"]) in target]
@@ -0,0 +1,139 @@
+"""Adaptive multi-pass scanning for the scanner."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from ipaddress import IPv4Address
+
+from .backends import ScanBackend, get_backend
+from .classifier import MACClassifier
+from .planner import HostIndex, ShardPlanner
+from .scanner import async_get_target_networks, async_iter_scanner, filter_hosts
+from .targets import intervals_to_networks, merge_intervals, subtract_intervals
+
+_LOGGER = logging.getLogger(__name__)
+_LOGGER.setLevel(logging.DEBUG)
+
+
+def _size(intervals: list[tuple[int, int]]) -> int:
+    return sum(last - first + 1 for first, last in intervals)
+
+
+def coarsen_intervals(intervals: list[tuple[int, int]], max_blocks: int = 64,
+                      max_extra: int | None = None) -> list[tuple[int, int]]:
+    """Bridge the smallest gaps until the intervals fit in max_blocks CIDR blocks.
+
+    The silent addresses of a busy subnet are scattered, a block per
+    address would spawn a sweep per address. Re-sweeping a few hosts
+    which already answered is cheaper, at most max_extra of them (as
+    many as the silent addresses by default) are bridged by the gaps.
+    When the blocks still do not fit, the interval covering them all is
+    swept, one big sweep costs less than hundreds of small ones.
+    """
+    silent = _size(intervals)
+    max_extra = silent if max_extra is None else max_extra
+    gap = 1
+    while len(intervals_to_networks(intervals)) > max_blocks and len(intervals) > 1:
+        bridged = [intervals[0]]
+        for first, last in intervals[1:]:
+            if first - bridged[-1][1] - 1 <= gap:
+                bridged[-1] = (bridged[-1][0], last)
+            else:
+                bridged.append((first, last))
+        ## the blocks of the bridged intervals may cover more than the intervals
+        if sum(net.num_addresses for net in intervals_to_networks(bridged)) - silent > max_extra:
+            break
+        intervals = bridged
+        gap *= 2
+    if len(intervals_to_networks(intervals)) > max_blocks:
+        return [(intervals[0][0], intervals[-1][1])]
+    return intervals
+
+
+async def async_iter_multipass(ip_net_str: str = "",
+                               mac_pattern: str | None = None,
+                               backend: str | ScanBackend | None = "auto",
+                               planner: ShardPlanner | None = None,
+                               classifier: MACClassifier | None = None,
+                               max_passes: int = 3,
+                               time_budget: float | None = None,
+                               max_blocks: int = 64,
+                               on_pass=None):
+    """Yield the hosts of up to max_passes sweeps, every pass only sweeps the silent addresses.
+
+    The scan stops when a pass finds no new host, all addresses have
+    answered or the time budget (seconds) is spent. The silent addresses
+    are swept exactly, a backend paying per block (arp-scan, af-packet)
+    gets them coarsened to max_blocks blocks. on_pass(report) is
+    called after every pass with {"pass", "addresses", "answered", "new",
+    "matched", "seconds"}.
+    """
+
+    scan_backend = get_backend(backend)
+    networks = [net for net in await async_get_target_networks(ip_net_str) if net.version == 4]
+    silent = merge_intervals([(int(net.network_address), int(net.broadcast_address)) for net in networks])
+
+    host_index = HostIndex()
+    answered: set[str] = set()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + time_budget if time_budget else None
+
+    for number in range(1, max_passes + 1):
+        if not silent:
+            break
+        if scan_backend.cost_per_block:
+            targets = intervals_to_networks(coarsen_intervals(silent, max_blocks))
+        else:
+            targets = intervals_to_networks(silent)
+        report = {"pass": number,
+                  "addresses": sum(net.num_addresses for net in targets),
+                  "answered": 0, "new": 0, "matched": 0, "seconds": 0.0}
+        start = time.monotonic()
+
+        ## every host answering counts, the mac pattern only filters the yield
+        hosts = async_iter_scanner(" ".join(str(net) for net in targets), mac_pattern=r".*",
+                                   backend=scan_backend, planner=planner)
+        try:
+            while True:
+                remaining = deadline - loop.time() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    break
+                try:
+                    host = await asyncio.wait_for(hosts.__anext__(), remaining)
+                except (StopAsyncIteration, asyncio.TimeoutError):
+                    break
+
+                report["answered"] += 1
+                if host["ip"] not in answered:
+                    answered.add(host["ip"])
+                    report["new"] += 1
+                if (host := next(filter_hosts([host], mac_pattern, classifier), None)) and host_index.add(host):
+                    report["matched"] += 1
+                    yield host
+        finally:
+            await hosts.aclose()
+
+        report["seconds"] = round(time.monotonic() - start, 3)
+        _LOGGER.debug(f"scan pass {report}")
+        if on_pass is not None:
+            on_pass(report)
+
+        answered_intervals = merge_intervals([(int(IPv4Address(ip)),) * 2 for ip in answered if ":" not in ip])
+        silent = subtract_intervals(silent, answered_intervals)
+        if report["new"] == 0 or (deadline and loop.time() >= deadline):
+            break
+
+
+async def async_multipass_scan(ip_net_str: str = "", **kwargs) -> tuple[list[dict], list[dict]]:
+    """Run the multi-pass scan to the end, return (hosts, pass reports)."""
+    reports = []
+    on_pass = kwargs.pop("on_pass", None)
+
+    def collect(report):
+        reports.append(report)
+        if on_pass is not None:
+            on_pass(report)
+
+    hosts = [host async for host in async_iter_multipass(ip_net_str, on_pass=collect, **kwargs)]
+    return hosts, reports
@@ -0,0 +1,278 @@
+"""Passive discovery from the kernel neighbor table and the ARP traffic."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import socket
+import struct
+import sys
+from ipaddress import IPv4Address, IPv4Network, IPv6Network, ip_address
+
+from .backends import (ETH_P_ARP, ScanBackend, parse_arp_frame,
+                       register_backend)
+
+_LOGGER = logging.getLogger(__name__)
+_LOGGER.setLevel(logging.DEBUG)
+
+PROC_NET_ARP = "/proc/net/arp"
+
+## netlink
+NETLINK_ROUTE = 0
+RTMGRP_NEIGH = 0x4
+RTM_NEWNEIGH = 28
+RTM_GETNEIGH = 30
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NDA_DST = 1
+NDA_LLADDR = 2
+
+## the neighbor states
+NUD_REACHABLE = 0x02
+NUD_PERMANENT = 0x80
+## confirmed lately or static, the host is alive
+NUD_LIVE = NUD_REACHABLE | NUD_PERMANENT
+## STALE, DELAY, PROBE: the MAC was known, the host may be gone long ago
+NUD_VALID = NUD_LIVE | 0x04 | 0x08 | 0x10
+
+LIVE = "live"
+STALE = "stale"
+
+_NLMSG_HEADER = struct.Struct("=IHHII")
+_NDMSG = struct.Struct("=BBHiHBB")
+_RTATTR = struct.Struct("=HH")
+
+ZERO_MAC = "00:00:00:00:00:00"
+
+
+def _neighbor_record(ip: str, mac: str, interface: str, state: str = LIVE) -> dict:
+    if ":" in ip and interface:
+        ip = f"{ip}%{interface}"
+    return {"mac": mac.upper(), "ip": ip, "interface": interface, "state": state}
+
+
+def read_proc_arp(path: str = PROC_NET_ARP) -> list[dict]:
+    """Read the IPv4 neighbors of /proc/net/arp.
+
+    The file has no reachability, only the permanent entries are LIVE.
+    """
+    neighbors = []
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()[1:]
+    except OSError:
+        return neighbors
+
+    for line in lines:
+        ## IP address  HW type  Flags  HW address  Mask  Device
+        tokens = line.split()
+        if len(tokens) < 6:
+            continue
+        ip, _, flags, mac, _, interface = tokens[:6]
+        ## ATF_COM: the entry is completed
+        if not int(flags, 16) & 0x2 or mac == ZERO_MAC:
+            continue
+        ## ATF_PERM: a static entry
+        state = LIVE if int(flags, 16) & 0x4 else STALE
+        neighbors.append(_neighbor_record(ip, mac, interface, state))
+    return neighbors
+
+
+def parse_neighbor_messages(data: bytes) -> tuple[list[dict], bool]:
+    """Parse the netlink neighbor messages, return (neighbors, done)."""
+    neighbors = []
+    offset = 0
+    while offset + _NLMSG_HEADER.size <= len(data):
+        msg_len, msg_type, _, _, _ = _NLMSG_HEADER.unpack_from(data, offset)
+        if msg_len < _NLMSG_HEADER.size:
+            break
+        if msg_type in (NLMSG_DONE, NLMSG_ERROR):
+            return neighbors, True
+
+        body = offset + _NLMSG_HEADER.size
+        if msg_type == RTM_NEWNEIGH and body + _NDMSG.size <= offset + msg_len:
+            family, _, _, ifindex, state, _, _ = _NDMSG.unpack_from(data, body)
+            attrs = {}
+            attr_offset = body + _NDMSG.size
+            while attr_offset + _RTATTR.size <= offset + msg_len:
+                attr_len, attr_type = _RTATTR.unpack_from(data, attr_offset)
+                if attr_len < _RTATTR.size:
+                    break
+                attrs[attr_type] = data[attr_offset + _RTATTR.size:attr_offset + attr_len]
+                attr_offset += (attr_len + 3) & ~3
+
+            dst, lladdr = attrs.get(NDA_DST), attrs.get(NDA_LLADDR)
+            if state & NUD_VALID and dst and lladdr and len(lladdr) == 6:
+                mac = ":".join(f"{b:02X}" for b in lladdr)
+                if mac != ZERO_MAC:
+                    try:
+                        interface = socket.if_indextoname(ifindex)
+                    except OSError:
+                        interface = ""
+                    neighbors.append(_neighbor_record(str(ip_address(dst)), mac, interface,
+                                                      LIVE if state & NUD_LIVE else STALE))
+
+        offset += (msg_len + 3) & ~3
+    return neighbors, False
+
+
+def dump_neighbors(family: int = socket.AF_UNSPEC) -> list[dict]:
+    """Dump the kernel neighbor table by netlink, fall back to /proc/net/arp.
+
+    Every record has a "state", LIVE or STALE. A STALE entry needs an
+    active probe to tell the host is still there.
+    """
+    if not sys.platform.startswith("linux"):
+        return []
+
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    except (OSError, AttributeError):
+        return read_proc_arp()
+
+    neighbors = []
+    with sock:
+        sock.settimeout(2)
+        request = _NDMSG.pack(family, 0, 0, 0, 0, 0, 0)
+        header = _NLMSG_HEADER.pack(_NLMSG_HEADER.size + len(request), RTM_GETNEIGH,
+                                    NLM_F_REQUEST | NLM_F_DUMP, 1, 0)
+        try:
+            sock.send(header + request)
+            done = False
+            while not done:
+                records, done = parse_neighbor_messages(sock.recv(65536))
+                neighbors.extend(records)
+        except OSError as e:
+            _LOGGER.warning(f"netlink neighbor dump failed: {e}")
+            return read_proc_arp()
+    return neighbors
+
+
+def _in_networks(host: dict, networks: list[IPv4Network | IPv6Network] | None) -> bool:
+    if not networks:
+        return True
+    address = ip_address(host["ip"].split("%")[0])
+    return any(address in net for net in networks if net.version == address.version)
+
+
+async def async_get_neighbors(networks: list[IPv4Network | IPv6Network] | None = None,
+                              family: int = socket.AF_INET,
+                              include_stale: bool = False) -> list[dict]:
+    """Get the live (REACHABLE or PERMANENT) neighbors inside the networks, off the event loop."""
+    loop = asyncio.get_running_loop()
+    neighbors = await loop.run_in_executor(None, dump_neighbors, family)
+    return [host for host in neighbors
+            if (include_stale or host["state"] == LIVE) and _in_networks(host, networks)]
+
+
+async def _async_watch_netlink(on_found, family):
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    with sock:
+        sock.bind((0, RTMGRP_NEIGH))
+        sock.setblocking(False)
+        loop = asyncio.get_running_loop()
+        while True:
+            records, _ = parse_neighbor_messages(await loop.sock_recv(sock, 65536))
+            for host in records:
+                if family == socket.AF_UNSPEC or (family == socket.AF_INET) != (":" in host["ip"]):
+                    on_found(host)
+
+
+async def _async_sniff_arp(on_found):
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ARP))
+    with sock:
+        sock.setblocking(False)
+        loop = asyncio.get_running_loop()
+        while True:
+            frame, address = await loop.sock_recvfrom(sock, 2048)
+            arp = parse_arp_frame(frame)
+            ## a probe is sent from 0.0.0.0
+            if arp and arp[1] != "0.0.0.0" and arp[2] != ZERO_MAC:
+                on_found(_neighbor_record(arp[1], arp[2], address[0]))
+
+
+async def async_iter_neighbors(networks: list[IPv4Network | IPv6Network] | None = None,
+                               listen: float = 0,
+                               sniff: bool = False,
+                               family: int = socket.AF_INET,
+                               include_stale: bool = False):
+    """Yield the live neighbor table hosts, then keep listening for `listen` seconds.
+
+    While listening, the new netlink neighbor entries are yielded and, with
+    `sniff`, the senders of the ARP traffic seen on the wire (needs a raw
+    socket). A host is yielded once per (ip, mac).
+    """
+    seen = set()
+
+    def is_new(host):
+        key = (host["ip"], host["mac"])
+        if (not include_stale and host["state"] != LIVE) or key in seen or not _in_networks(host, networks):
+            return False
+        seen.add(key)
+        return True
+
+    for host in await async_get_neighbors(networks, family, include_stale):
+        if is_new(host):
+            yield host
+
+    if listen <= 0 or not sys.platform.startswith("linux"):
+        return
+
+    queue: asyncio.Queue = asyncio.Queue()
+    watchers = [_async_watch_netlink(queue.put_nowait, family)]
+    if sniff:
+        watchers.append(_async_sniff_arp(queue.put_nowait))
+
+    async def watch(coro):
+        try:
+            await coro
+        except OSError as e:
+            _LOGGER.warning(f"passive watcher stopped: {e}")
+
+    tasks = [asyncio.create_task(watch(coro)) for coro in watchers]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + listen
+    try:
+        while (remaining := deadline - loop.time()) > 0:
+            try:
+                host = await asyncio.wait_for(queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if is_new(host):
+                yield host
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@register_backend
+class NeighborTableBackend(ScanBackend):
+    """Answer from the kernel neighbor table without sending anything.
+
+    Only the live entries count, include_stale also takes the STALE ones
+    which may belong to hosts gone long ago.
+    """
+
+    name = "neighbors"
+
+    def __init__(self, listen: float = 0, sniff: bool = False, include_stale: bool = False):
+        self.listen = listen
+        self.sniff = sniff
+        self.include_stale = include_stale
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return sys.platform.startswith("linux")
+
+    async def async_scan(self, ip_net: IPv4Network | IPv4Address, timeout: float = 5,
+                         rate: float | None = None) -> list[dict]:
+        return [host async for host in self.async_iter_scan(ip_net, timeout, rate)]
+
+    async def async_iter_scan(self, ip_net: IPv4Network | IPv4Address, timeout: float = 5,
+                              rate: float | None = None):
+        networks = [IPv4Network(str(ip_net), False)]
+        async for host in async_iter_neighbors(networks, min(self.listen, timeout), self.sniff,
+                                               include_stale=self.include_stale):
+            yield {"mac": host["mac"], "ip": host["ip"]}
@@ -0,0 +1,112 @@
+"""Scan planner for the scanner."""
+from __future__ import annotations
+
+import asyncio
+import logging
+from ipaddress import IPv4Network, IPv6Network, collapse_addresses
+
+_LOGGER = logging.getLogger(__name__)
+_LOGGER.setLevel(logging.DEBUG)
+
+
+def collapse_networks(networks: list[IPv4Network | IPv6Network]) -> list[IPv4Network | IPv6Network]:
+    """Merge the overlapping and adjacent networks, so no address is scanned twice."""
+
+    ipv4 = [net for net in networks if net.version == 4]
+    ipv6 = [net for net in networks if net.version == 6]
+
+    collapsed: list[IPv4Network | IPv6Network] = list(collapse_addresses(ipv4))
+    collapsed.extend(collapse_addresses(ipv6))
+
+    if len(collapsed) != len(networks):
+        _LOGGER.debug(f"collapse networks: {networks} -> {collapsed}")
+    return collapsed
+
+
+class HostIndex(object):
+    """Unique hosts keyed by (ip, mac) with the IPs claimed by several MACs."""
+
+    def __init__(self):
+        self._hosts: dict[tuple[str, str], dict] = {}
+        self._ip_macs: dict[str, set[str]] = {}
+
+    def __len__(self):
+        return len(self._hosts)
+
+    def __contains__(self, host: dict):
+        return (host["ip"], host["mac"]) in self._hosts
+
+    def add(self, host: dict) -> bool:
+        """Add the host, return False if it is already indexed."""
+        key = (host["ip"], host["mac"])
+        if key in self._hosts:
+            return False
+
+        self._hosts[key] = host
+        macs = self._ip_macs.setdefault(host["ip"], set())
+        macs.add(host["mac"])
+        if len(macs) == 2:
+            _LOGGER.warning(f"ip ({host['ip']}) is claimed by multiple MACs: {sorted(macs)}")
+        return True
+
+    def hosts(self) -> list[dict]:
+        return list(self._hosts.values())
+
+    def conflicts(self) -> dict[str, list[str]]:
+        """The IPs seen with multiple MACs."""
+        return {ip: sorted(macs) for ip, macs in self._ip_macs.items() if len(macs) > 1}
+
+
+class ShardPlanner(object):
+    """Split big targets into shards and run them under a concurrency and rate budget.
+
+    shard_prefix: the networks bigger than this prefix are split into subnets of it.
+    concurrency:  the number of shards scanned at the same time.
+    rate:         the packets per second shared by the running shards of one interface.
+    tries:        the number of requests a backend may send per address.
+    base_timeout: the seconds given to every shard on top of its sending time.
+    """
+
+    def __init__(self,
+                 shard_prefix: int = 24,
+                 concurrency: int = 8,
+                 rate: float = 2000,
+                 tries: int = 3,
+                 base_timeout: float = 2):
+        self.shard_prefix = shard_prefix
+        self.concurrency = concurrency
+        self.rate = rate
+        self.tries = tries
+        self.base_timeout = base_timeout
+
+    def plan(self, networks: list[IPv4Network | IPv6Network]) -> list[IPv4Network | IPv6Network]:
+        """Collapse the networks and split them to shards."""
+        shards = []
+        for net in collapse_networks(networks):
+            if net.version == 4 and net.prefixlen < self.shard_prefix:
+                shards.extend(net.subnets(new_prefix=self.shard_prefix))
+            else:
+                shards.append(net)
+        return shards
+
+    def shard_rate(self, shard_count: int) -> float:
+        """The packet rate of one shard when shard_count shards are planned."""
+        return self.rate / max(1, min(self.concurrency, shard_count))
+
+    def shard_timeout(self, shard: IPv4Network | IPv6Network, rate: float) -> float:
+        """The timeout of a shard sized from its address count."""
+        return self.base_timeout + shard.num_addresses * self.tries / rate
+
+    async def async_run(self, shards: list[IPv4Network | IPv6Network], scan) -> list[dict]:
+        """Run `scan(shard, timeout=, rate=)` for all shards and merge the hosts."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        rate = self.shard_rate(len(shards))
+
+        async def run(shard):
+            async with semaphore:
+                timeout = self.shard_timeout(shard, rate)
+                _LOGGER.debug(f"scan shard {shard}, timeout: {timeout:.1f} sec, rate: {rate:.0f} pps")
+                return await scan(shard, timeout=timeout, rate=rate)
+
+        results = await asyncio.gather(*(run(shard) for shard in shards))
+        return [host for hosts in results if hosts for host in hosts]
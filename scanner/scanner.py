@@ -5,17 +5,24 @@ import platform
 import re
 import sys
 import time
-from ipaddress import (IPv4Address, IPv4Network, IPv6Network, ip_network,
-                       summarize_address_range)
+from ipaddress import IPv4Address, IPv4Network, IPv6Network, ip_network
 
 import network
-from core import cyl_util
+from core import cyl_process, cyl_util
+
+from . import linklocal, multicast, passive
+from .backends import (ScanBackend, async_find_source, async_group_by_interface,
+                       get_backend, register_backend)
+from .classifier import MACClassifier, get_default_classifier
+from .planner import HostIndex, ShardPlanner, collapse_networks
+from .targets import compile_targets, iter_address_chunks
 
 _LOGGER = logging.getLogger(__name__)
 _LOGGER.setLevel(logging.DEBUG)
 
 MAC_PATTERN = r'([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})'
 IP_PATTERN = r'\b(?:\d{1,3}\.){3}\d{1,3}\b'
+DEFAULT_MAC_PATTERN = r'^D0:14:11:B'  # used when mac_families.json cannot be loaded
 
 def resource_path(relative_path):
     try:
@@ -39,8 +46,8 @@ elif SYS_PLATFORM == 'WINDOWS':
     OPTION = "-t"
 
 def scan_devices(ip: str, timeout=30):
-    
-    ret, msg = cyl_util.run_cmd(f'{ARP_EXE} {OPTION} {ip}', timeout=timeout) ####
+
+    ret, msg = cyl_util.run_cmd([ARP_EXE, *arp_scan_args(ip)], timeout=timeout) ####
     # ret, msg = cyl_util.run_cmd(f'{exe_file} -t {ip}', timeout=timeout)
     if not ret or not msg:
         return []
@@ -49,84 +56,130 @@ def scan_devices(ip: str, timeout=30):
     output_lines = msg.splitlines()
     devices = []
     for line in output_lines:
-        mac_match = re.search(MAC_PATTERN, line)
-        ip_match = re.search(IP_PATTERN, line)
-        
-        if mac_match:
-            mac = mac_match.group(0)
-            # print(f"MAC Address: {mac_address}")
-
-        if ip_match:
-            ip = ip_match.group(0)
-            # print(f"IP Address: {ip_address}")
-        
-        if cyl_util.is_valid_IP(ip) and cyl_util.is_valid_MAC(mac):
-            devices.append({"mac": mac, "ip": ip})
+        if device := parse_arp_scan_line(line):
+            devices.append(device)
 
     return devices
 
 
-async def async_run_arp_scan(ip_net: str, timeout=5):
-    # start executing a command in a subprocess
+def arp_scan_rate_options(rate: float | None = None) -> list[str]:
+    """The arp-scan options to send `rate` packets per second."""
 
-    opt = OPTION.split(" ")
-    
-    if SYS_PLATFORM == 'WINDOWS':
-        CREATE_NO_WINDOW = 0x08000000
-        process = await asyncio.create_subprocess_exec(f'{ARP_EXE}', *opt, ip_net, ####
-                                                    stdout=asyncio.subprocess.PIPE,
-                                                    stderr=asyncio.subprocess.PIPE,
-                                                    creationflags=CREATE_NO_WINDOW)
-    else:
-        process = await asyncio.create_subprocess_exec(f'{ARP_EXE}', *opt, ip_net, ####
-                                                    stdout=asyncio.subprocess.PIPE,
-                                                    stderr=asyncio.subprocess.PIPE)
+    ## The windows arp-scan only knows the target option.
+    if not rate or SYS_PLATFORM == 'WINDOWS':
+        return []
+    return [f"--interval={max(1, int(1000000 / rate))}u"]
 
-    try:
-        stdout, stderr = await process.communicate()
-        await asyncio.wait_for(process.wait(), timeout=timeout)
-        # print(f"{ip_net}: {stdout}, {stderr}")
-        return True, stdout.decode('utf-8').strip()
-    except Exception as err:
-        _LOGGER.error(f"{ip_net} timed out")
-        process.kill()
-        return False, 'Process timed out'
 
+def arp_scan_interface_options(interface: str | None = None) -> list[str]:
+    """The arp-scan options to send through the interface, none on windows."""
 
-async def async_scan_device(ip_net: str, timeout=5):
-    ret, msg = await async_run_arp_scan(ip_net, timeout=timeout)
+    if not interface or SYS_PLATFORM == 'WINDOWS':
+        return []
+    return [f"--interface={interface}"]
 
-    if not ret or not msg:
+
+def arp_scan_args(ip_net: str, rate: float | None = None, interface: str | None = None) -> list[str]:
+    """The arp-scan arguments of one target network."""
+    opt = [o for o in OPTION.split(" ") if o]
+    return opt + arp_scan_interface_options(interface) + arp_scan_rate_options(rate) + [ip_net]
+
+
+async def async_run_arp_scan(ip_net: str, timeout=5, rate: float | None = None, interface: str | None = None):
+    """Run arp-scan under the timeout, the lines printed before it are kept."""
+
+    return await cyl_process.PROCESS_RUNNER.async_run(ARP_EXE, *arp_scan_args(ip_net, rate, interface),
+                                                      timeout=timeout)
+
+
+def parse_arp_scan_line(line: str) -> dict | None:
+    """Parse one arp-scan output line to a host record."""
+
+    ## the header tells the MAC/IP of the local interface
+    if line.startswith("Interface:"):
+        return None
+
+    mac_match = re.search(MAC_PATTERN, line)
+    ip_match = re.search(IP_PATTERN, line)
+
+    mac = mac_match.group(0) if mac_match else ""
+    ip_addr = ip_match.group(0) if ip_match else ""
+
+    if cyl_util.is_valid_IP(ip_addr) and cyl_util.is_valid_MAC(mac):
+        return {"mac": mac.upper(), "ip": ip_addr}
+    return None
+
+
+async def async_scan_device(ip_net: str, timeout=5, rate: float | None = None, interface: str | None = None):
+    ret, msg = await async_run_arp_scan(ip_net, timeout=timeout, rate=rate, interface=interface)
+
+    ## a timed out scan still returns the hosts found before it
+    if not msg:
         return []
 
     # print(f"{ret} {msg}")
     output_lines = msg.splitlines()
     devices = []
     for line in output_lines:
+        if device := parse_arp_scan_line(line):
+            devices.append(device)
 
-        mac_match = re.search(MAC_PATTERN, line)
-        ip_match = re.search(IP_PATTERN, line)
-        
-        mac = mac_match.group(0) if mac_match else ""
-        ip_addr = ip_match.group(0) if ip_match else ""
+    return devices
 
-        if cyl_util.is_valid_IP(ip_addr) and cyl_util.is_valid_MAC(mac):
-            devices.append({"mac": mac.upper(), "ip": ip_addr})
 
-    return devices
+async def async_iter_scan_device(ip_net: str, timeout=5, rate: float | None = None,
+                                 interface: str | None = None):
+    """Yield the arp-scan hosts as soon as their lines are printed."""
 
+    async for line in cyl_process.PROCESS_RUNNER.async_iter_lines(ARP_EXE, *arp_scan_args(ip_net, rate, interface),
+                                                                  timeout=timeout):
+        if device := parse_arp_scan_line(line):
+            yield device
 
-async def async_scan_devices(ip_net_list: list[IPv4Network | IPv4Address]):
-    timeout = 5
-    tasks = []
-    for ip_net in ip_net_list:
-        tasks.append(asyncio.create_task(async_scan_device(str(ip_net), timeout=timeout)))
 
-    result = await asyncio.gather(*tasks)
-    devices = []
-    for device in result:
-        if device:
-            devices.extend(device)
+@register_backend
+class ArpScanBackend(ScanBackend):
+    """Scan by spawning the arp-scan executable.
+
+    The target is sent through the interface which owns it, the
+    unowned targets go where arp-scan chooses.
+    """
+
+    name = "arp-scan"
+    cost_per_block = True
+
+    @staticmethod
+    async def _async_interface(ip_net) -> str | None:
+        source = await async_find_source(ip_network(str(ip_net), False), fallback=False)
+        return source[0] if source else None
+
+    async def async_scan(self, ip_net: IPv4Network | IPv4Address, timeout: float = 5,
+                         rate: float | None = None) -> list[dict]:
+        interface = await self._async_interface(ip_net)
+        return await async_scan_device(str(ip_net), timeout=timeout, rate=rate, interface=interface)
+
+    async def async_iter_scan(self, ip_net: IPv4Network | IPv4Address, timeout: float = 5,
+                              rate: float | None = None):
+        interface = await self._async_interface(ip_net)
+        async for device in async_iter_scan_device(str(ip_net), timeout=timeout, rate=rate,
+                                                   interface=interface):
+            yield device
+
+
+async def async_scan_devices(ip_net_list: list[IPv4Network | IPv4Address],
+                             backend: str | ScanBackend | None = "arp-scan",
+                             planner: ShardPlanner | None = None):
+    """Scan the networks shard by shard under the planner budget.
+
+    The interfaces are scanned in parallel, each one with its own budget.
+    """
+
+    planner = planner or ShardPlanner()
+    scan_backend = get_backend(backend)
+    groups = await async_group_by_interface(planner.plan(ip_net_list))
+    results = await asyncio.gather(*(planner.async_run(shards, scan_backend.async_scan)
+                                     for shards in groups.values()))
+    devices = [device for devices in results for device in devices]
 
     # print(devices)
     # print(len(devices))
@@ -153,52 +206,52 @@ async def async_get_networks(ip_type: str="ipv4") -> list[IPv4Network | IPv6Netw
     return networks
 
 
+def filter_hosts(hosts, mac_pattern: str | None = None, classifier: MACClassifier | None = None):
+    """Filter the hosts by the classifier prefixes if given, else by the mac pattern.
+
+    With neither of them the MAC families of mac_families.json are used,
+    DEFAULT_MAC_PATTERN if the table cannot be loaded. The hosts kept by
+    a classifier are tagged with its family/model.
+    """
+
+    if classifier is None and mac_pattern is None:
+        classifier = get_default_classifier()
+        mac_pattern = DEFAULT_MAC_PATTERN
+    if classifier is not None:
+        return classifier.tag_hosts(hosts)
+    return (host for host in hosts if re.match(mac_pattern, host['mac']))
+
+
 async def async_discovery_MAC(ip_net_list: list[IPv4Network | IPv4Address],
-                              mac_pattern: str = r'^D0:14:11:B'):
+                              mac_pattern: str | None = None,
+                              backend: str | ScanBackend | None = "arp-scan",
+                              planner: ShardPlanner | None = None,
+                              classifier: MACClassifier | None = None):
 
-    host_list = await async_scan_devices(ip_net_list)
+    host_list = await async_scan_devices(ip_net_list, backend=backend, planner=planner)
 
     # host_list = scan_devices(network)
     # print(host_list)
-    cyl_devices = [host for host in host_list if re.match(mac_pattern, host['mac'])]
+    cyl_devices = list(filter_hosts(host_list, mac_pattern, classifier))
     return cyl_devices
 
 
 # @cyl_wrapper.handle_exception
 def ipv4_range_to_cidr(start="", end=""):
     """manual setting by range"""
-    first = []
-    last = []
-    if not end:
-        tokens = start.split(".")
-        if len(tokens) != 4:
-            return []
-        
-        for t in tokens:
-            sub = t.split("-")
-            first.append(sub[0])
-            if len(sub) == 1:
-                last.append(sub[0])
-            elif len(sub) == 2:
-                last.append(sub[1])
-            else:
-                return []
-
-        start = ".".join(first)
-        end = ".".join(last)
-
-    if ip_network(start) > ip_network(end):
-        start, end = end, start
-
-    return list(summarize_address_range(IPv4Address(start), IPv4Address(end)))
-
-
-def get_all_address_from_networks(networks: list[IPv4Network | IPv6Network]):
-    address = []
-    for net in networks:
-        for addr in net:
-            address.append(addr)
-    return address
+
+    expression = f"{start}-{end}" if end else start
+    try:
+        return compile_targets(expression)
+    except ValueError as e:
+        _LOGGER.error(e)
+        return []
+
+
+def get_all_address_from_networks(networks: list[IPv4Network | IPv6Network], offset: int = 0):
+    """Yield every address of the networks lazily, from the offset."""
+    for chunk in iter_address_chunks(networks, offset=offset):
+        yield from chunk
 
 
 ## ==============================================
@@ -230,7 +283,8 @@ def get_all_address_from_networks(networks: list[IPv4Network | IPv6Network]):
 ## ==============================================
 ## ==============================================
 
-async def async_scan_network(network: IPv4Network | IPv6Network, mac_pattern: str = r'^D0:14:11:B'):
+async def async_scan_network(network: IPv4Network | IPv6Network, mac_pattern: str | None = None,
+                             backend: str | ScanBackend | None = "arp-scan"):
 
     _LOGGER.debug(network)
     addrs = []
@@ -238,46 +292,150 @@ async def async_scan_network(network: IPv4Network | IPv6Network, mac_pattern: st
     # if SYS_PLATFORM != 'WINDOWS':
     #     addrs.append(network)
     # else:
-    #     addrs = get_all_address_from_networks([network])
+    #     addrs = get_all_address_from_networks([network])  ## lazy, walked in chunks
     # print(len(addrs))
-    return await async_discovery_MAC(addrs, mac_pattern)
+    return await async_discovery_MAC(addrs, mac_pattern, backend=backend)
 
 
-async def async_main_scanner(ip_net_str: str="", mac_pattern: str = r'^D0:14:11:B'):
+def _parse_target_networks(ip_net_str: str) -> list[IPv4Network]:
+    ## manual setting: IPs, ranges, CIDRs, !exclusions and @file includes
+    return compile_targets(ip_net_str)
 
-    networks = []
+
+async def async_get_target_networks(ip_net_str: str="") -> list[IPv4Network]:
     if not ip_net_str:
         ## auto scan network
         networks = await async_get_networks()
-    elif len(ip_net_str.split("-")) > 1:
-        ## manual setting
-        networks= ipv4_range_to_cidr(ip_net_str)
     else:
-        networks = [IPv4Network(ip_net_str)]
-
+        networks = _parse_target_networks(ip_net_str)
+    return collapse_networks(networks)
+
+
+async def async_main_scanner(ip_net_str: str="", mac_pattern: str | None = None,
+                             backend: str | ScanBackend | None = "auto",
+                             planner: ShardPlanner | None = None,
+                             classifier: MACClassifier | None = None,
+                             passive_seed: bool = False):
+    """Scan the networks for the hosts matching the mac pattern.
+
+    backend:      "auto", "arp-scan", "af-packet", "neighbors", "ipv6-ll", "mdns",
+                  "fake" or a ScanBackend instance.
+    planner:      the shard size, concurrency and packet rate budget of the scan.
+    mac_pattern:  a regex overriding the MAC families of mac_families.json.
+    classifier:   filter and tag the hosts by these MAC prefixes instead.
+    passive_seed: merge the hosts already in the kernel neighbor table.
+    """
+
+    networks = await async_get_target_networks(ip_net_str)
     print(networks)
 
-    hosts=[]
-    tasks = []
-    for net in networks:
-        task = async_scan_network(net, mac_pattern=mac_pattern)
-        tasks.append(task)
-    
-    # Waiting for all process done
-    results = await asyncio.gather(*tasks)
-    for res in results:
-        hosts+=res
+    scan_backend = get_backend(backend)
+    _LOGGER.debug(f"scan backend: {scan_backend.name}")
+
+    # Waiting for all shards done
+    hosts = await async_discovery_MAC(networks, mac_pattern, backend=scan_backend,
+                                      planner=planner, classifier=classifier)
 
     print(len(hosts))
 
-    uni_hosts = []
+    if passive_seed:
+        neighbors = await passive.async_get_neighbors(networks)
+        hosts.extend(filter_hosts(neighbors, mac_pattern, classifier))
+
+    host_index = HostIndex()
     for host in hosts:
-        if host not in uni_hosts:
-            uni_hosts.append(host)
+        host_index.add(host)
+    if conflicts := host_index.conflicts():
+        _LOGGER.warning(f"IPs with multiple MACs: {conflicts}")
+
+    uni_hosts = host_index.hosts()
     print(len(uni_hosts))
     return uni_hosts
 
 
+async def async_iter_scanner(ip_net_str: str="", mac_pattern: str | None = None,
+                             backend: str | ScanBackend | None = "auto",
+                             planner: ShardPlanner | None = None,
+                             classifier: MACClassifier | None = None,
+                             target_count: int = 0,
+                             target_macs: set[str] | None = None,
+                             passive_seed: bool = False,
+                             passive_listen: float = 0):
+    """Yield the unique hosts matching the mac pattern as soon as they are found.
+
+    The scan stops early when `target_count` hosts have been yielded or
+    every MAC of `target_macs` has been seen. Leaving the loop early
+    also cancels the running scans.
+
+    With `passive_seed` the hosts of the kernel neighbor table come
+    first, and for `passive_listen` seconds the new neighbor entries
+    are merged while the active scan runs.
+    """
+
+    planner = planner or ShardPlanner()
+    networks = await async_get_target_networks(ip_net_str)
+    shards = planner.plan(networks)
+    scan_backend = get_backend(backend)
+    _LOGGER.debug(f"scan backend: {scan_backend.name}, shards: {len(shards)}")
+
+    pending_macs = {mac.upper() for mac in target_macs} if target_macs else set()
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    async def scan(shard, semaphore, rate):
+        try:
+            async with semaphore:
+                timeout = planner.shard_timeout(shard, rate)
+                async for host in scan_backend.async_iter_scan(shard, timeout=timeout, rate=rate):
+                    queue.put_nowait(host)
+        except Exception as e:
+            _LOGGER.error(f"{shard} Exception caught- {type(e).__name__}: {e}")
+        finally:
+            queue.put_nowait(done)
+
+    async def listen():
+        try:
+            async for host in passive.async_iter_neighbors(networks, listen=passive_listen):
+                queue.put_nowait({"mac": host["mac"], "ip": host["ip"]})
+        except Exception as e:
+            _LOGGER.error(f"neighbors Exception caught- {type(e).__name__}: {e}")
+        finally:
+            queue.put_nowait(done)
+
+    ## every interface is scanned in parallel with its own budget
+    tasks = []
+    for group in (await async_group_by_interface(shards)).values():
+        semaphore = asyncio.Semaphore(planner.concurrency)
+        rate = planner.shard_rate(len(group))
+        tasks.extend(asyncio.create_task(scan(shard, semaphore, rate)) for shard in group)
+    if passive_seed or passive_listen:
+        tasks.append(asyncio.create_task(listen()))
+    host_index = HostIndex()
+    running = len(tasks)
+    try:
+        while running:
+            host = await queue.get()
+            if host is done:
+                running -= 1
+                continue
+
+            if not (host := next(filter_hosts([host], mac_pattern, classifier), None)):
+                continue
+            if not host_index.add(host):
+                continue
+            yield host
+
+            pending_macs.discard(host["mac"])
+            if target_count and len(host_index) >= target_count:
+                break
+            if target_macs and not pending_macs:
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
 if __name__ == '__main__':
 
     start = time.time()
@@ -0,0 +1,228 @@
+"""Target expression compiler for the scanner.
+
+A target list holds tokens separated by spaces, commas, semicolons or
+new lines:
+
+    192.168.1.10                    one address
+    192.168.1.0/24                  a network
+    192.168.1.10-20                 a range of the last octet
+    192.168.1-2.10-20               ranges of octets, from 192.168.1.10 to 192.168.2.20
+    192.168.1.10-192.168.3.5        a range of addresses
+    !192.168.1.1                    an exclusion, any of the forms above
+    @targets.txt                    the tokens of a file, '#' starts a comment
+
+The tokens are turned to integer intervals, which are sorted, merged and
+subtracted in one sweep, then every interval is summarized to the fewest
+CIDR blocks.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import re
+from ipaddress import IPv4Address, IPv4Network, IPv6Address, IPv6Network
+
+_LOGGER = logging.getLogger(__name__)
+_LOGGER.setLevel(logging.DEBUG)
+
+_SEPARATORS = re.compile(r"[\s,;]+")
+_ADDRESS = re.compile(r"(0|[1-9]\d{0,2})\.(0|[1-9]\d{0,2})\.(0|[1-9]\d{0,2})\.(0|[1-9]\d{0,2})")
+
+
+def _parse_address(text: str, token: str) -> int:
+    ## plain int math, IPv4Address() is the bottleneck of long lists
+    match = _ADDRESS.fullmatch(text)
+    if match:
+        a, b, c, d = (int(octet) for octet in match.groups())
+        if a <= 255 and b <= 255 and c <= 255 and d <= 255:
+            return a << 24 | b << 16 | c << 8 | d
+    raise ValueError(f"target: '{token}' is not a valid IPv4 target.")
+
+
+def _parse_octet_ranges(token: str) -> tuple[int, int]:
+    ## the legacy form: every octet may be a range, the lows make the start
+    first = last = 0
+    octets = token.split(".")
+    if len(octets) != 4:
+        raise ValueError(f"target: '{token}' is not a valid IPv4 target.")
+    for octet in octets:
+        low, dash, high = octet.partition("-")
+        ## "4-" has no end, it is not the single 4
+        high = high if dash else low
+        if not (low.isdigit() and high.isdigit()) or int(low) > 255 or int(high) > 255:
+            raise ValueError(f"target: '{token}' is not a valid IPv4 target.")
+        first = first << 8 | int(low)
+        last = last << 8 | int(high)
+    return first, last
+
+
+def parse_target(token: str) -> tuple[int, int]:
+    """Parse one target token to an inclusive (first, last) integer interval."""
+
+    if "/" in token:
+        try:
+            net = IPv4Network(token, strict=False)
+        except ValueError:
+            raise ValueError(f"target: '{token}' is not a valid IPv4 target.") from None
+        return int(net.network_address), int(net.broadcast_address)
+
+    if "-" not in token:
+        address = _parse_address(token, token)
+        return address, address
+
+    start, _, end = token.partition("-")
+    if end.count(".") == 3 and start.count(".") == 3:
+        first, last = _parse_address(start, token), _parse_address(end, token)
+    else:
+        first, last = _parse_octet_ranges(token)
+    return (first, last) if first <= last else (last, first)
+
+
+def iter_target_tokens(text: str, base_dir: str = ".", _including: frozenset = frozenset()):
+    """Yield the (token, excluded) pairs of the text, the @file includes expanded."""
+
+    for line in text.splitlines():
+        line = line.split("#", 1)[0]
+        for token in _SEPARATORS.split(line.strip()):
+            if not token:
+                continue
+
+            excluded = token.startswith("!")
+            token = token.lstrip("!")
+            if not token.startswith("@"):
+                yield token, excluded
+                continue
+
+            path = os.path.abspath(os.path.join(base_dir, token[1:]))
+            if path in _including:
+                raise ValueError(f"target: '{token}' includes itself.")
+            try:
+                with open(path, encoding="utf-8") as f:
+                    content = f.read()
+            except OSError as e:
+                raise ValueError(f"target: '{token}' cannot be read: {e.strerror}") from None
+            for sub_token, sub_excluded in iter_target_tokens(content, os.path.dirname(path),
+                                                              _including | {path}):
+                ## an excluded include excludes all of its targets
+                yield sub_token, sub_excluded or excluded
+
+
+def merge_intervals(intervals: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Sort and merge the overlapping and adjacent intervals."""
+
+    merged: list[list[int]] = []
+    for first, last in sorted(intervals):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return [(first, last) for first, last in merged]
+
+
+def subtract_intervals(includes: list[tuple[int, int]],
+                       excludes: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Remove the excludes from the includes, both merged, in one sweep."""
+
+    result = []
+    i = 0
+    for first, last in includes:
+        ## skip the excludes before this interval
+        while i < len(excludes) and excludes[i][1] < first:
+            i += 1
+        j = i
+        while j < len(excludes) and excludes[j][0] <= last:
+            ex_first, ex_last = excludes[j]
+            if ex_first > first:
+                result.append((first, ex_first - 1))
+            first = ex_last + 1
+            if first > last:
+                break
+            j += 1
+        if first <= last:
+            result.append((first, last))
+    return result
+
+
+def summarize_interval(first: int, last: int):
+    """Yield the fewest CIDR blocks covering the interval, like summarize_address_range()."""
+
+    while first <= last:
+        ## the biggest block aligned on first which does not pass last
+        size = first & -first if first else 1 << 32
+        while size > last - first + 1:
+            size >>= 1
+        yield IPv4Network((first, 33 - size.bit_length()))
+        first += size
+
+
+def intervals_to_networks(intervals: list[tuple[int, int]]) -> list[IPv4Network]:
+    """Summarize the disjoint intervals to the fewest CIDR blocks."""
+
+    return [net for first, last in intervals for net in summarize_interval(first, last)]
+
+
+def compile_targets(text: str, base_dir: str = ".") -> list[IPv4Network]:
+    """Compile a target list to the minimal CIDR cover of its included addresses.
+
+    Raise ValueError on an invalid token.
+    """
+
+    includes = []
+    excludes = []
+    for token, excluded in iter_target_tokens(text, base_dir):
+        (excludes if excluded else includes).append(parse_target(token))
+
+    networks = intervals_to_networks(subtract_intervals(merge_intervals(includes),
+                                                        merge_intervals(excludes)))
+    _LOGGER.debug(f"targets: {len(includes)} included, {len(excludes)} excluded -> {len(networks)} networks")
+    return networks
+
+
+class AddressCursor(object):
+    """Walk the addresses of networks in fixed-size chunks with constant memory.
+
+    The addresses are made from integer ranges chunk by chunk, `offset`
+    counts the addresses handed out so far and can be saved as a
+    checkpoint to resume a later walk from it.
+    """
+
+    def __init__(self, networks: list[IPv4Network | IPv6Network], chunk_size: int = 256,
+                 offset: int = 0, hosts_only: bool = False):
+        self.chunk_size = chunk_size
+        self.offset = offset
+        self._ranges = []
+        for net in networks:
+            first, last = int(net.network_address), int(net.broadcast_address)
+            ## like hosts(): no network/broadcast address on an IPv4 network bigger than /31
+            if hosts_only and net.version == 4 and net.prefixlen < 31:
+                first, last = first + 1, last - 1
+            self._ranges.append((first, last, IPv4Address if net.version == 4 else IPv6Address))
+
+    def __len__(self):
+        return sum(last - first + 1 for first, last, _ in self._ranges)
+
+    def __iter__(self):
+        skip = self.offset
+        chunk = []
+        for first, last, address_class in self._ranges:
+            size = last - first + 1
+            if skip >= size:
+                skip -= size
+                continue
+            for value in range(first + skip, last + 1):
+                chunk.append(address_class(value))
+                if len(chunk) == self.chunk_size:
+                    self.offset += len(chunk)
+                    yield chunk
+                    chunk = []
+            skip = 0
+        if chunk:
+            self.offset += len(chunk)
+            yield chunk
+
+
+def iter_address_chunks(networks: list[IPv4Network | IPv6Network], chunk_size: int = 256,
+                        offset: int = 0, hosts_only: bool = False):
+    """Yield the addresses of the networks in lists of chunk_size, from the offset."""
+
+    yield from AddressCursor(networks, chunk_size, offset, hosts_only)
@@ -5,15 +5,14 @@ import threading
 import time
 import tkinter as tk
 from ctypes import byref, c_int, sizeof  # , windll
-from ipaddress import IPv4Network
 from tkinter import messagebox, ttk
 
 import customtkinter as ctk
 from ttkthemes import ThemedStyle
 
-from core import (cyl_async_ping, cyl_async_ssh, cyl_async_telnet, cyl_util,
-                  cyl_wrapper)
-from scanner import scanner
+from core import (cyl_async_ping, cyl_async_ssh, cyl_async_telnet, cyl_fleet,
+                  cyl_inventory, cyl_ssh_pool, cyl_util, cyl_wrapper)
+from scanner import discovery, incremental, multipass, scanner, targets
 
 
 class TreeviewEditEntry():
@@ -313,6 +312,12 @@ class popupWindow_SCP_Setting(popupWindow):
         
         self.storage_folder = tk.StringVar(value=scp_config["storage_folder"])
 
+        ## the fleet limits of the SCP / OS command actions
+        fleet = cyl_fleet.CYLFleetScheduler.from_config(scp_config.get("fleet"))
+        self.max_hosts      = tk.IntVar(value=fleet.max_hosts)
+        self.max_per_subnet = tk.IntVar(value=fleet.max_per_subnet)
+        self.start_rate     = tk.DoubleVar(value=fleet.start_rate)
+
         ## Create UI
         self.create_ui()
 
@@ -321,14 +326,17 @@ class popupWindow_SCP_Setting(popupWindow):
 
     def create_ui(self):
         self.create_input_field("Storage Folder:", self.storage_folder, 0, 0, 50)
+        self.create_input_field("Max hosts at once:", self.max_hosts, 1, 0)
+        self.create_input_field("Max hosts connecting at once per subnet:", self.max_per_subnet, 2, 0)
+        self.create_input_field("Connections started per second:", self.start_rate, 3, 0)
 
         table_title = ttk.Label(self.popup,
                                 text="Variable Table:",
                                 style="my.TLabel")
-        table_title.grid(row=1, column=0, padx=5, pady=5)
+        table_title.grid(row=4, column=0, padx=5, pady=5)
 
         table_frame = ttk.Frame(self.popup)
-        table_frame.grid(row=2, column=0, columnspan=3, padx=10, pady=0, sticky=tk.W)
+        table_frame.grid(row=5, column=0, columnspan=3, padx=10, pady=0, sticky=tk.W)
 
         self.variable_treeview = ttk.Treeview(table_frame, selectmode="extended", style="my.Treeview", height=10)
 
@@ -408,15 +416,25 @@ class popupWindow_SCP_Setting(popupWindow):
 
         ## Submit Button
         submit_button = ttk.Button(self.popup, text="Submit", command=self.save_configuration)
-        submit_button.grid(row=3, column=0, columnspan=2, padx=5, pady=5)
+        submit_button.grid(row=6, column=0, columnspan=2, padx=5, pady=5)
 
     def save_configuration(self):
         storage_folder = os.path.abspath(self.storage_folder.get())
         if not os.path.isdir(storage_folder):
             messagebox.showerror("Error", f"'{storage_folder}' is not a folder.", parent=self.popup)
             return
+        try:
+            fleet = {"max_hosts": self.max_hosts.get(),
+                     "max_per_subnet": self.max_per_subnet.get(),
+                     "start_rate": self.start_rate.get()}
+        except tk.TclError:
+            messagebox.showerror("Error", "The fleet limits must be numbers.", parent=self.popup)
+            return
+        if fleet["max_hosts"] < 1 or fleet["max_per_subnet"] < 1 or fleet["start_rate"] < 0:
+            messagebox.showerror("Error", "The fleet limits must be positive.", parent=self.popup)
+            return
 
-        self.scp_config = {"storage_folder": self.storage_folder.get()}
+        self.scp_config = {"storage_folder": self.storage_folder.get(), "fleet": fleet}
 
         result_dict = {}
         for row in self.variable_treeview.get_children():
@@ -617,6 +635,15 @@ class MyApp(ctk.CTk):
 
         self.process_threads = {}
 
+        ## Device inventory
+        self.inventory = cyl_inventory.CYLInventory()
+
+        ## SSH connections are kept between the actions,
+        ## they are bound to one event loop which runs in the background.
+        self.async_loop = asyncio.new_event_loop()
+        threading.Thread(target=self.async_loop.run_forever, daemon=True).start()
+        self.ssh_pool = cyl_ssh_pool.CYLSSHPool()
+
         ## for Ping
         self.is_pinging = False
         self.ping_config = {"packet_count": 1, "schedule_sec": 1, "interval": 0.3, "timeout": 1}
@@ -629,8 +656,21 @@ class MyApp(ctk.CTk):
         
     def on_closing(self):
         self.output_default_content()
+        self.inventory.close()
+        ## close the pool and stop the loop on the loop thread, the Tk thread does not
+        ## wait for it, a running scan may be waiting for a Tk update
+        closing = asyncio.run_coroutine_threadsafe(self.ssh_pool.async_close(), self.async_loop)
+        closing.add_done_callback(lambda _: self.async_loop.call_soon_threadsafe(self.async_loop.stop))
         self.destroy()
 
+    def fleet_scheduler(self):
+        """The fleet scheduler with the limits of the SCP setting."""
+        return cyl_fleet.CYLFleetScheduler.from_config(self.scp_config.get("fleet"))
+
+    def run_async(self, coro):
+        """Run the coroutine on the background event loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.async_loop).result()
+
     def is_thread_alive(self, key):
         return self.process_threads.get(key) and self.process_threads.get(key).is_alive()
 
@@ -704,18 +744,19 @@ class MyApp(ctk.CTk):
         if SCP_Setting := cyl_util.load_config_json(os.path.join('recall','SCP_Setting.json')):
             self.scp_config = SCP_Setting
 
-        if Scan_items := cyl_util.load_config_json(os.path.join('recall','Scan_items.json')):
-            for item_info in Scan_items.get("scan_items"):
-                text = item_info["text"]
-                values = item_info["values"]
-                self.scan_treeview.insert("", "end", text=text, values=values)
-
+        Scan_items = cyl_util.load_config_json(os.path.join('recall','Scan_items.json')) or {}
+        if Scan_items:
             self.OS_connection_mode = Scan_items.get("OS_connection_mode", self.OS_connection_mode)
             scan_network = Scan_items.get("scan_network", self.ip_range_entry.get())
             self.ip_range_entry.delete(0, tk.END)
             self.ip_range_entry.insert(tk.END, scan_network)
         # self.scp_config
 
+        ## The scan table comes from the inventory, the rows of an old Scan_items.json
+        ## are shown only if the inventory is empty
+        self.load_inventory_lazily(history=Scan_items.get("history", {}),
+                                   fallback_items=Scan_items.get("scan_items", []))
+
         LGW_content = cyl_util.load_config_json(os.path.join('recall','LGW_Cmds.json'))
         OS_content = cyl_util.load_config_json(os.path.join('recall','OS_Cmds.json'))
 
@@ -756,6 +797,37 @@ class MyApp(ctk.CTk):
             self.os_cmd_timeout_entry.insert(0, str(self.default_OS_cmd_timeout_sec))
 
 
+    def load_inventory_lazily(self, history=None, fallback_items=None, batch_size=50):
+        """Fill the scan table from the inventory one batch per idle callback.
+
+        history is the {mac: history text} of the rows, fallback_items the
+        {"text", "values"} rows shown when the inventory has no device.
+        """
+        history = history or {}
+        batches = self.inventory.iter_devices(batch_size)
+        columns = self.scan_treeview["columns"]
+        inserted = False
+
+        def insert_next_batch():
+            nonlocal inserted
+            if not (batch := next(batches, None)):
+                if not inserted:
+                    with self.scan_treeview_lock:
+                        for item_info in fallback_items or []:
+                            self.scan_treeview.insert("", "end", text=item_info["text"], values=item_info["values"])
+                self.refresh_window_status()
+                return
+
+            inserted = True
+            with self.scan_treeview_lock:
+                for device in batch:
+                    values = {**device["info"], "ip": device["ip"], "mac": device["mac"], "ping": 0}
+                    self.scan_treeview.insert("", "end", text=history.get(device["mac"], ""),
+                                              values=[values.get(col, "") for col in columns])
+            self.after(1, insert_next_batch)
+
+        self.after_idle(insert_next_batch)
+
     def output_default_content(self):
         ## OS Cmds
         os_cmd_json = {"operations":[], "timeout_sec": int(self.os_cmd_timeout_entry.get())}
@@ -782,18 +854,14 @@ class MyApp(ctk.CTk):
         cyl_util.output_config_json(lgw_cmd_json, os.path.join('recall','LGW_Cmds.json'))
         cyl_util.output_config_json(self.scp_config, os.path.join('recall','SCP_Setting.json'))
 
-        ## LGW Cmds
+        ## Scan settings, the rows themselves are in the inventory
         scan_items_json = {"scan_network": self.ip_range_entry.get(),
                            "OS_connection_mode": self.OS_connection_mode,
-                           "scan_items": []}
+                           "history": {}}
 
         for item in self.scan_treeview.get_children():
-            item_data = self.scan_treeview.item(item)
-            item_info = {
-                "text": item_data["text"],
-                "values": item_data["values"]
-            }
-            scan_items_json["scan_items"].append(item_info)
+            if text := self.scan_treeview.item(item, "text"):
+                scan_items_json["history"][str(self.scan_treeview.set(item, "mac")).upper()] = text
 
         cyl_util.output_config_json(scan_items_json, os.path.join('recall','Scan_items.json'))
 
@@ -858,11 +926,25 @@ class MyApp(ctk.CTk):
                                 text="Scan Table:",
                                 style="my.TLabel")
 
+        # Incremental scan: only re-probe the new or moved devices
+        self.incremental_scan_var = tk.BooleanVar(value=False)
+        incremental_check = ttk.Checkbutton(base_frame,
+                                            text="Incremental",
+                                            variable=self.incremental_scan_var)
+
+        # Multi-pass scan: re-sweep the silent addresses until no new device shows up
+        self.multi_pass_scan_var = tk.BooleanVar(value=False)
+        multi_pass_check = ttk.Checkbutton(base_frame,
+                                           text="Multi-pass",
+                                           variable=self.multi_pass_scan_var)
+
         ## Arrange widget
         ip_range_label.grid(     row=0,  column=0, padx=10, pady=5, sticky=tk.W)
         self.ip_range_entry.grid(row=0,  column=1, padx=10, pady=5, sticky=tk.W)
         scan_button.grid(        row=0,  column=2, padx=10, pady=5, sticky=tk.W)
         table_title.grid(        row=1,  column=0, padx=10, pady=5, sticky=tk.W)
+        incremental_check.grid(  row=1,  column=2, padx=10, pady=5, sticky=tk.W)
+        multi_pass_check.grid(   row=1,  column=1, padx=10, pady=5, sticky=tk.E)
 
         ## Scan table
         table_frame = ttk.Frame(base_frame)
@@ -1379,11 +1461,13 @@ class MyApp(ctk.CTk):
                                                                       timeout=timeout_sec))
             elif self.OS_connection_mode == "SSH":
                 username = "root"
-                res = asyncio.run(cyl_async_ssh.send_ssh_cmds(hosts,
-                                                              username,
-                                                              self.ssh_password,
-                                                              cmd_list=cmd_list,
-                                                              timeout=timeout_sec))
+                res = self.run_async(cyl_async_ssh.send_ssh_cmds(hosts,
+                                                                 username,
+                                                                 self.ssh_password,
+                                                                 cmd_list=cmd_list,
+                                                                 pool=self.ssh_pool,
+                                                                 scheduler=self.fleet_scheduler(),
+                                                                 timeout=timeout_sec))
             # print(res)
             self.output_text_insert(f"Send OS Cmds finish!!!\n", "progress")
             txt_bar = '----------------------'
@@ -1425,21 +1509,9 @@ class MyApp(ctk.CTk):
         if not ip_range:
             target_networks = asyncio.run(scanner.async_get_networks())
         else:
-            range_token = ip_range.split('.')[-1]
-
             # Validate input
             try:
-                if "-" in range_token:
-                    t = range_token.split("-")
-                    if cyl_util.is_float(t[0]) and cyl_util.is_float(t[1]):
-                        target_networks = scanner.ipv4_range_to_cidr(start=ip_range)
-                elif "/" in range_token:
-                    t = range_token.split("/")
-                    if cyl_util.is_float(t[0]) and cyl_util.is_float(t[1]):
-                        target_networks = [IPv4Network(ip_range)]
-                else:
-                    if cyl_util.is_float(range_token):
-                        target_networks = [IPv4Network(ip_range)]
+                target_networks = targets.compile_targets(ip_range)
             except Exception as e:
                 messagebox.showerror("Error", str(e), parent=self)
                 return
@@ -1463,7 +1535,10 @@ class MyApp(ctk.CTk):
         self.refresh_window_status()
 
         ## Scan by thread
-        self.process_threads["scan_devices"] = threading.Thread(target=self.scan_devices, args=(ip_range,))
+        self.process_threads["scan_devices"] = threading.Thread(target=self.scan_devices,
+                                                                args=(ip_range,
+                                                                      self.incremental_scan_var.get(),
+                                                                      self.multi_pass_scan_var.get()))
         self.process_threads["scan_devices"].daemon = True
         self.process_threads["scan_devices"].start()
 
@@ -1531,92 +1606,198 @@ class MyApp(ctk.CTk):
                     self.scan_treeview.item(item, tags=("offline",))
                 self.scan_treeview_lock.release()
 
-    def get_devices_info(self, hosts):
-        ## OS, RS, RN, OTA
-        cmd_dict = {"os": "cat /etc/os_version",
+    OS_INFO_CMDS = {"os": "cat /etc/os_version",
                     "restart server": "cat /root/restart_server.sh|grep -Eom 1 'v[0-9]+\.[0-9]+\.[0-9]+'",
                     "restart network": "cat /root/restart_network.sh|grep -Eom 1 'v[0-9]+\.[0-9]+\.[0-9]+'",
                     "ota": "cat /root/ota.sh|grep -Eom 1 'v[0-9]+\.[0-9]+\.[0-9]+'",
                     "mac": "flash get HW_NIC1_ADDR | cut -d '=' -f 2"}
-        
-        self.output_text_insert(f"\nGet devices info start...", "progress")
-        res = None
-        if self.OS_connection_mode == "Telnet":
-            res = asyncio.run(cyl_async_telnet.send_telnet_23cmds(hosts,
-                                                                    cmd_list=cmd_dict.values()))
-        elif self.OS_connection_mode == "SSH":
-            username = "root"
-            res = asyncio.run(cyl_async_ssh.send_ssh_cmds(hosts,
-                                                            username,
-                                                            self.ssh_password,
-                                                            cmd_list=cmd_dict.values()))
 
-        device_info_dict={}
-        for host in hosts:
-            ip = host['ip']
-            device_info = {}
-            for i, cmd_return in enumerate(res[ip]):
-                key = list(cmd_dict.keys())[i]
-                device_info[key] = MyApp.OS_out_version_result_filter(cmd_return["result"])
-                if key == "mac" and not cyl_util.is_valid_MAC(host['mac']):
-                    host["mac"] = device_info[key]
-            device_info_dict[ip] = device_info
+    DEVICE_INFO_KEYS = list(OS_INFO_CMDS) + ["model-id", "commit-id", "light gateway", "product-id(json)", "product-id"]
+
+    ## The number of hosts probed at the same time
+    INFO_WORKERS = 32
 
+    @staticmethod
+    def make_9528_info_cmds():
         cmd_template_list = []
         tid = cyl_util.make_target_id("", 0)
         cmd_template_list.append(cyl_util.make_cmd("read-attr", target_id=tid, attr="model-id"))
         cmd_template_list.append(cyl_util.make_cmd("read-attr", target_id=tid, attr="commit-id"))
         cmd_template_list.append(cyl_util.make_cmd("configure"))
         cmd_template_list.append(cyl_util.make_cmd("read-attr", target_id=tid, attr="product-id"))
-        res = asyncio.run(cyl_async_telnet.send_telnet_9528cmds(hosts, cmd_template_list=cmd_template_list))
-
-        for host in hosts:
-            ip = host['ip']
-            result = res[ip]
-            device_info_dict[ip]["model-id"] = MyApp.telnet9528_out_result_filter(result[0]["result"], "value")
-            device_info_dict[ip]["commit-id"] = MyApp.telnet9528_out_result_filter(result[1]["result"], "value")
-            device_info_dict[ip]["os"] = MyApp.telnet9528_out_result_filter(result[2]["result"], "os-version")
-            device_info_dict[ip]["light gateway"] = MyApp.telnet9528_out_result_filter(result[2]["result"], "server-version")
-            device_info_dict[ip]["product-id(json)"] = MyApp.telnet9528_out_result_filter(result[2]["result"], "product-id")
-            device_info_dict[ip]["product-id"] = MyApp.telnet9528_out_result_filter(result[3]["result"], "value")
+        return cmd_template_list
+
+    async def async_get_device_info(self, host):
+        """Get the info of one host by the OS cmds and the 9528 cmds."""
+        ## OS, RS, RN, OTA
+        cmd_dict = MyApp.OS_INFO_CMDS
+        res = None
+        if self.OS_connection_mode == "Telnet":
+            res = await cyl_async_telnet.async_send_cmd_list(host['ip'],
+                                                             port=23,
+                                                             cmd_list=cmd_dict.values(),
+                                                             expect_string="#")
+        elif self.OS_connection_mode == "SSH":
+            username = "root"
+            res = await cyl_async_ssh.async_send_cmd_list(host['ip'],
+                                                          username,
+                                                          self.ssh_password,
+                                                          cmd_list=cmd_dict.values(),
+                                                          pool=self.ssh_pool,
+                                                          session=True)
+
+        device_info = {}
+        for i, cmd_return in enumerate(res):
+            key = list(cmd_dict.keys())[i]
+            device_info[key] = MyApp.OS_out_version_result_filter(cmd_return["result"])
+            if key == "mac" and not cyl_util.is_valid_MAC(host['mac']):
+                host["mac"] = device_info[key]
+
+        cmd_list = cyl_async_telnet.make_9528cmd_list(host, MyApp.make_9528_info_cmds())
+        result = await cyl_async_telnet.async_send_cmd_list(host['ip'],
+                                                            port=9528,
+                                                            cmd_list=cmd_list,
+                                                            expect_string=":#")
+
+        device_info["model-id"] = MyApp.telnet9528_out_result_filter(result[0]["result"], "value")
+        device_info["commit-id"] = MyApp.telnet9528_out_result_filter(result[1]["result"], "value")
+        device_info["os"] = MyApp.telnet9528_out_result_filter(result[2]["result"], "os-version")
+        device_info["light gateway"] = MyApp.telnet9528_out_result_filter(result[2]["result"], "server-version")
+        device_info["product-id(json)"] = MyApp.telnet9528_out_result_filter(result[2]["result"], "product-id")
+        device_info["product-id"] = MyApp.telnet9528_out_result_filter(result[3]["result"], "value")
+        return device_info
+
+    async def async_pipeline_devices_info(self, host_iter, on_device_info, workers=None, probe=None):
+        """Probe the hosts from an async iterator by a bounded worker pool.
+
+        Every host goes to a worker as soon as it comes out of host_iter and
+        on_device_info(host, device_info) is called when its info is done.
+        probe(host) returns the device info, default is async_get_device_info.
+        """
+        workers = workers or MyApp.INFO_WORKERS
+        probe = probe or self.async_get_device_info
+        queue = asyncio.Queue(maxsize=workers)
+
+        async def worker():
+            while (host := await queue.get()) is not None:
+                ## a failing host or callback must not kill the worker, the queue would block
+                try:
+                    device_info = await probe(host)
+                    on_device_info(host, device_info)
+                except Exception as e:
+                    self.output_text_insert(f"host ({host['ip']}) Exception caught- {type(e).__name__}: {e}", "red")
+
+        worker_tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+        try:
+            async for host in host_iter:
+                await queue.put(host)
+            for _ in worker_tasks:
+                await queue.put(None)
+            await asyncio.gather(*worker_tasks)
+        finally:
+            for task in worker_tasks:
+                task.cancel()
+
+    def get_devices_info(self, hosts):
+        self.output_text_insert(f"\nGet devices info start...", "progress")
+
+        async def iter_hosts():
+            for host in hosts:
+                yield host
+
+        device_info_dict={}
+        def on_device_info(host, device_info):
+            device_info_dict[host['ip']] = device_info
+
+        self.run_async(self.async_pipeline_devices_info(iter_hosts(), on_device_info))
 
         self.output_text_insert(f"Get devices info finish!!!\n", "progress")
         return device_info_dict
 
-    def scan_devices(self, ip_net_str: str=""):
-
-        hosts = asyncio.run(scanner.async_main_scanner(ip_net_str=ip_net_str))
-
-        device_info_dict = self.get_devices_info(hosts)
-        # print(res)
-        # print(hosts)
-        ## Update treeview
-        for host in hosts:
-            ip = host['ip']
-            mac = cyl_util.format_MAC(device_info_dict[ip]['mac'])
-            if cyl_util.is_valid_MAC(mac):
-                mac = cyl_util.format_MAC(device_info_dict[ip]['mac']).upper()
-            if not cyl_util.is_valid_MAC(host['mac']):
-                host['mac'] = mac
-            item_values = (host['ip'], host['mac'],
-                            device_info_dict[ip]["model-id"],
-                            0,
-                            device_info_dict[ip]["os"],
-                            device_info_dict[ip]["restart server"],
-                            device_info_dict[ip]["restart network"],
-                            device_info_dict[ip]["ota"],
-                            device_info_dict[ip]["commit-id"],
-                            device_info_dict[ip]["light gateway"],
-                            device_info_dict[ip]["product-id(json)"],
-                            device_info_dict[ip]["product-id"])
-            self.scan_treeview_lock.acquire()
-            self.scan_treeview.insert("", "end", values=item_values)
-            self.scan_treeview_lock.release()
-
-        ## Enable ip scan frame
-        self.enableChildren(self.ip_scan_frame)
-        self.refresh_window_status()
-        self.output_text_insert(f"Find {len(hosts)} devices.")
+    @staticmethod
+    def make_item_values(host, device_info, ping=0):
+        mac = cyl_util.format_MAC(device_info['mac'])
+        if cyl_util.is_valid_MAC(mac):
+            mac = mac.upper()
+        if not cyl_util.is_valid_MAC(host['mac']):
+            host['mac'] = mac
+        return (host['ip'], host['mac'],
+                device_info["model-id"],
+                ping,
+                device_info["os"],
+                device_info["restart server"],
+                device_info["restart network"],
+                device_info["ota"],
+                device_info["commit-id"],
+                device_info["light gateway"],
+                device_info["product-id(json)"],
+                device_info["product-id"])
+
+    def make_incremental_probe(self, tracker):
+        """Reuse the inventory info of the unchanged hosts which pass a cheap check."""
+        port = 23 if self.OS_connection_mode == "Telnet" else 22
+
+        async def probe(host):
+            if tracker.update(host) == incremental.UNCHANGED:
+                device = self.inventory.get_device(host["mac"])
+                info = device["info"] if device else {}
+                if set(MyApp.DEVICE_INFO_KEYS) <= info.keys() and await incremental.async_check_host(host["ip"], port):
+                    return info
+            return await self.async_get_device_info(host)
+
+        return probe
+
+    def scan_devices(self, ip_net_str: str="", incremental_scan: bool=False, multi_pass_scan: bool=False):
+
+        found = {}
+        def insert_device(host, device_info):
+            item_values = MyApp.make_item_values(host, device_info)
+            self.inventory.record_device(host, device_info)
+            with self.scan_treeview_lock:
+                ## a moved MAC comes again with its new ip, update its row
+                if host['mac'] in found:
+                    self.scan_treeview.item(found[host['mac']], values=item_values)
+                else:
+                    found[host['mac']] = self.scan_treeview.insert("", "end", values=item_values)
+
+        probe = None
+        if incremental_scan:
+            known = {device["mac"]: device["ip"]
+                        for batch in self.inventory.iter_devices() for device in batch}
+            tracker = incremental.IncrementalScan(known)
+            probe = self.make_incremental_probe(tracker)
+
+        def report_pass(report):
+            self.output_text_insert(f"pass {report['pass']}: {report['new']} new of {report['answered']} answers, "
+                                    f"{report['addresses']} addresses in {report['seconds']} sec")
+
+        ## Scan and probe at the same time, the rows show up one by one.
+        if multi_pass_scan:
+            host_iter = multipass.async_iter_multipass(ip_net_str, on_pass=report_pass)
+        else:
+            ## One row per MAC, the stale neighbor table entries are left out.
+            host_iter = discovery.async_iter_hosts(ip_net_str, sources=("auto",))
+        try:
+            self.run_async(self.async_pipeline_devices_info(host_iter, insert_device, probe=probe))
+            self.inventory.flush()
+
+            if incremental_scan:
+                networks = asyncio.run(scanner.async_get_target_networks(ip_net_str))
+                events = tracker.finish(networks)
+                self.output_text_insert(f"\nScan changes:", "title")
+                for event in events:
+                    if event["event"] == incremental.ADDED:
+                        self.output_text_insert(f"+ {event['mac']} ({event['ip']})")
+                    elif event["event"] == incremental.MOVED:
+                        self.output_text_insert(f"~ {event['mac']} ({event['old_ip']} -> {event['ip']})")
+                    else:
+                        self.output_text_insert(f"- {event['mac']} ({event['old_ip']})", "red")
+                self.output_text_insert(f"{len(events)} changes.")
+        finally:
+            ## Enable ip scan frame, also when the scan failed
+            self.enableChildren(self.ip_scan_frame)
+            self.refresh_window_status()
+        self.output_text_insert(f"Find {len(found)} devices.")
         self.output_text_insert(f"Scan devices finish!!!\n", "progress")
 
     @cyl_wrapper.setVar("reverse", False)
@@ -1669,31 +1850,22 @@ class MyApp(ctk.CTk):
             for item in selected_items:
                 host = self.scan_treeview.set(item)
                 ip = host['ip']
-                mac = cyl_util.format_MAC(device_info_dict[ip]['mac'])
-                if cyl_util.is_valid_MAC(mac):
-                    mac = cyl_util.format_MAC(device_info_dict[ip]['mac']).upper()
-                if not cyl_util.is_valid_MAC(host['mac']):
-                    host['mac'] = mac
-                item_values = (host['ip'], host['mac'],
-                                device_info_dict[ip]["model-id"],
-                                host['ping'],
-                                device_info_dict[ip]["os"],
-                                device_info_dict[ip]["restart server"],
-                                device_info_dict[ip]["restart network"],
-                                device_info_dict[ip]["ota"],
-                                device_info_dict[ip]["commit-id"],
-                                device_info_dict[ip]["light gateway"],
-                                device_info_dict[ip]["product-id(json)"],
-                                device_info_dict[ip]["product-id"])
+                if ip not in device_info_dict:
+                    continue
+                item_values = MyApp.make_item_values(host, device_info_dict[ip], host['ping'])
+                self.inventory.record_device(host, device_info_dict[ip])
                 self.scan_treeview_lock.acquire()
                 self.scan_treeview.item(item, values=item_values)
                 self.scan_treeview_lock.release()
+            self.inventory.flush()
 
             ## show
             self.output_text_insert(f"\nGet device info:", "title")
             for item in selected_items:
                 device = self.scan_treeview.set(item)
                 ip = device['ip']
+                if ip not in device_info_dict:
+                    continue
                 res_text = [f"{self.scan_treeview.heading(k, option='text')}\t{v}" for k, v in device_info_dict[ip].items()]
                 res_text = '\n'.join(res_text)
                 item_text = f"Device info:\n{res_text}"
@@ -1813,13 +1985,16 @@ class MyApp(ctk.CTk):
             hosts_config_variables = {k: v["value"] for k, v in self.scp_config["variables"].items()}
 
             self.output_text_insert(f"\nSCP {action} start...", "progress")
-            res = asyncio.run(cyl_async_ssh.scp_process(username, 
-                                                        password,
-                                                        remote_hosts,
-                                                        action,
-                                                        storage,
-                                                        config_name,
-                                                        hosts_config_variables))
+            res = self.run_async(cyl_async_ssh.scp_process(username,
+                                                           password,
+                                                           remote_hosts,
+                                                           action,
+                                                           storage,
+                                                           config_name,
+                                                           hosts_config_variables,
+                                                           pool=self.ssh_pool,
+                                                           scheduler=self.fleet_scheduler(),
+                                                           inventory=self.inventory))
             self.output_text_insert(f"SCP {action} finish!!!\n", "progress")
             # print(res)
             ## show
@@ -1827,6 +2002,7 @@ class MyApp(ctk.CTk):
             for item in selected_items:
                 device = self.scan_treeview.set(item)
                 result = res[device["ip"]]
+                self.inventory.record_scp_result(device, action, config_name, result)
                 item_text = f'SCP {action} result: {result}'
                 title = f"{device['model-id']}\t{device['mac']}\t({device['ip']})"
                 self.output_text_insert(f"\n{title}", "title")
@@ -1835,6 +2011,7 @@ class MyApp(ctk.CTk):
 
                 ## update item history
                 self.update_history_text(item, item_text)
+            self.inventory.flush()
 
         storage = self.scp_config.get("storage_folder", "storage")
         config_name = self.scp_config.get("config_name", "")